@@ -1,43 +1,432 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import datetime
 from functools import wraps
-from pymongo import MongoClient
+from pymongo import InsertOne, UpdateOne
+from pymongo.read_preferences import SecondaryPreferred
+import pymongo
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
 import logging
+import re
+import csv
+import io
+import hashlib
+import threading
+import time
+import uuid
+from cache import MemoryBackend, MongoBackend, ResponseCache, TTLCache
+from indexes import IndexCreationError, ensure_indexes, find_unindexed
+from logging_config import RateLimitedLogger, configure_logging, request_id_var
+from hashing import HasherSaturated, HasherUnavailable, PasswordHasher
+from instrumentation import CommandTimer, Metrics, PoolMonitor, SamplingProfiler, begin_request, end_request
+from config import Config, mongo_client_options
+from mongo import Mongo, read_preference_var
+from fanout import FanOut
+from ratelimit import MemoryBucketStore, RateLimiter
+from storage import SlotTaken, Storage
+from jsonprovider import json_encoder_for, make_json_provider
+from compression import COMPRESSIBLE_MIMETYPES, available_encodings, compress
+import serializers
+from werkzeug.middleware.proxy_fix import ProxyFix
+from changefeed import ChangeLog, sse_event
+from availability import (AvailabilityIndex, DEFAULT_SLOT_MINUTES, DEFAULT_WORKING_HOURS,
+                          MAX_RANGE_DAYS, free_slots, validate_schedule)
+import click
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
+# Configure logging; records are written by a background thread (see logging_config.py)
+configure_logging(Config.LOG_LEVEL, Config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
+# For messages logged once per row of a listing
+row_logger = RateLimitedLogger(logger)
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:5000"]}})
-app.config['SECRET_KEY'] = 'your-secret-key'
-
-# MongoDB Atlas connection
-MONGO_URI = 'mongodb+srv://karan:<kaRanlande45>@cluster0.icdaxwo.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0'
-client = MongoClient(MONGO_URI)
-db = client['physioconnect']
-users_collection = db['users']
-doctor_profiles_collection = db['doctor_profiles']
-appointments_collection = db['appointments']
-patient_profiles_collection = db['patient_profiles']
-
-# Ensure indexes for unique constraints
-try:
-    logger.info("Creating indexes")
-    users_collection.create_index('email', unique=True)
-    logger.info("Indexes created successfully")
-except Exception as e:
-    logger.error(f"Error creating indexes: {str(e)}")
+CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:5000"]}},
+     expose_headers=['X-Next-Cursor', 'Retry-After', 'RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'RateLimit-Policy'])
+app.config.from_object(Config)
+if app.config['TRUSTED_PROXY_COUNT']:
+    # Lets request.remote_addr, and so per-IP rate limits, see the client behind the proxies
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+# jsonify renders compact bodies through json_provider (orjson when installed); exports and
+# the change stream call it directly
+json_provider = make_json_provider(app.config['JSON_PROVIDER'])
+app.json_encoder = json_encoder_for(json_provider)
+
+# MongoDB connection; the client is created by the first query, not at import
+pool_monitor = PoolMonitor()
+mongo = Mongo(
+    app.config['MONGO_URI'],
+    app.config['MONGO_DB_NAME'],
+    event_listeners=[CommandTimer(), pool_monitor],
+    **mongo_client_options(app.config)
+)
+users_collection = mongo['users']
+doctor_profiles_collection = mongo['doctor_profiles']
+appointments_collection = mongo['appointments']
+patient_profiles_collection = mongo['patient_profiles']
+appointment_changes_collection = mongo['appointment_changes']
+counters_collection = mongo['counters']
+
+# Probes are answered before the schema is ensured: liveness never touches the database,
+# and /readyz reports a failed index build itself
+PROBE_ENDPOINTS = {'healthz', 'readyz', 'get_metrics'}
+
+class SchemaGuard:
+    """Runs storage.ensure_schema until it succeeds, at most once per backoff interval.
+
+    Only the required indexes (indexes.REQUIRED_INDEXES) hold back traffic; optional
+    ones that failed are listed in `missing`, reported and retried by /readyz. A caller
+    never waits for a build another thread is running.
+    """
+
+    def __init__(self, enabled, backoff, max_backoff):
+        self.ready = not enabled
+        self.complete = not enabled
+        self.error = None
+        self.missing = []
+        self.max_backoff = max_backoff
+        self._delay = backoff
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return not self.complete and time.monotonic() >= self._retry_at
+
+    def ensure(self):
+        """Build what is missing if an attempt is due; returns whether the required indexes exist."""
+        if not self._due() or not self._lock.acquire(blocking=False):
+            return self.ready
+        try:
+            if not self._due():
+                return self.ready
+            logger.info("Creating indexes")
+            try:
+                self.missing = storage.ensure_schema()
+                self.ready = True
+                self.error = None
+            except Exception as e:
+                logger.error("Schema setup failed: %s", e)
+                self.error = str(e)
+            if self.ready and not self.missing:
+                self.complete = True
+            else:
+                logger.warning("Retrying schema setup in %ss", self._delay)
+                self._retry_at = time.monotonic() + self._delay
+                self._delay = min(self._delay * 2, self.max_backoff)
+            return self.ready
+        finally:
+            self._lock.release()
+
+schema = SchemaGuard(app.config['ENSURE_INDEXES_ON_STARTUP'], app.config['SCHEMA_RETRY_SECONDS'],
+                     app.config['SCHEMA_RETRY_MAX_SECONDS'])
+
+def require_mongo_storage():
+    if not storage.supports_mongo_features:
+        raise click.UsageError(f"This command works on MongoDB; STORAGE_BACKEND is {app.config['STORAGE_BACKEND']}")
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create any missing indexes declared in indexes.py, or the SQL tables; run once per deploy."""
+    try:
+        missing = storage.ensure_schema()
+    except IndexCreationError as e:
+        raise click.ClickException(f"Indexes could not be created: {e}")
+    if missing:
+        raise click.ClickException(f"Optional indexes could not be created: {'; '.join(missing)}")
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Report query shapes that run as collection scans or sort in memory."""
+    require_mongo_storage()
+    unindexed = find_unindexed(mongo.db)
+    for collection_name, query, stage in unindexed:
+        click.echo(f"{stage} {collection_name}: {query}")
+    if unindexed:
+        raise SystemExit(1)
+    click.echo("All query shapes use an index")
+
+@app.cli.command('backfill-appointment-identities')
+@click.option('--all', 'refresh_all', is_flag=True, help='Rewrite every appointment, not only those missing the fields.')
+@click.option('--batch-size', default=500, show_default=True)
+def backfill_appointment_identities_command(refresh_all, batch_size):
+    """Copy doctor and patient names and emails into existing appointments."""
+    require_mongo_storage()
+    query = {} if refresh_all else {'$or': [{field: {'$exists': False}} for field in IDENTITY_FIELDS]}
+    last_id = None
+    updated = 0
+    while True:
+        page_query = dict(query, _id={'$gt': last_id}) if last_id else query
+        batch = list(appointments_collection.find(page_query, {'doctor_id': 1, 'user_id': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        # A repair pass: read every name from the database, not from this process's caches
+        embed_identities(batch, cached=False)
+        appointments_collection.bulk_write([
+            UpdateOne({'_id': appointment['_id']}, {'$set': {field: appointment[field] for field in IDENTITY_FIELDS}})
+            for appointment in batch
+        ], ordered=False)
+        updated += len(batch)
+        last_id = batch[-1]['_id']
+        click.echo(f"Backfilled {updated} appointments")
+    click.echo(f"Done: {updated} appointments updated")
+
+@app.cli.command('migrate-notes')
+@click.option('--batch-size', default=500, show_default=True)
+def migrate_notes_command(batch_size):
+    """Convert pre-migration notes strings into note_entries arrays."""
+    require_mongo_storage()
+    cap = app.config['APPOINTMENT_NOTES_CAP']
+    migrated = 0
+    while True:
+        batch = list(appointments_collection.find(
+            {'notes': {'$type': 'string'}},
+            {'notes': 1, 'note_entries': 1, 'notes_count': 1}
+        ).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for appointment in batch:
+            legacy = legacy_notes(appointment['notes'])
+            entries = legacy + appointment.get('note_entries', [])
+            update = {
+                '$set': {
+                    'note_entries': entries[-cap:] if cap else entries,
+                    'notes_count': appointment.get('notes_count', 0) + len(legacy),
+                    'latest_note': entries[-1] if entries else None
+                },
+                '$unset': {'notes': ''}
+            }
+            # Matching the string again keeps a concurrent $push from being overwritten
+            operations.append(UpdateOne({'_id': appointment['_id'], 'notes': appointment['notes'],
+                                         'notes_count': appointment.get('notes_count')}, update))
+        result = appointments_collection.bulk_write(operations, ordered=False)
+        migrated += result.modified_count
+        click.echo(f"Migrated {migrated} appointments")
+    click.echo(f"Done: {migrated} appointments migrated")
+
+# Per-request query counters, Server-Timing headers and /metrics
+metrics = Metrics()
+profiler = SamplingProfiler(interval=app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000)
+
+@app.before_request
+def assign_request_id():
+    request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-ID'] = request_id_var.get()
+    return response
+
+@app.teardown_request
+def clear_request_id(error=None):
+    request_id_var.set(None)
+
+@app.before_request
+def start_request_instrumentation():
+    begin_request()
+    if app.config['SLOW_REQUEST_PROFILE_MS']:
+        profiler.start()
+
+@app.after_request
+def finish_request_instrumentation(response):
+    stats = end_request()
+    if stats is None:
+        return response
+    duration = time.perf_counter() - stats.started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe(request.method, route, response.status_code, duration, stats)
+    timings = [f'db;desc="{stats.queries} queries";dur={stats.db_time * 1000:.2f}']
+    if stats.slowest_command:
+        timings.append(f'db-slowest;desc="{stats.slowest_command}";dur={stats.slowest_time * 1000:.2f}')
+    timings.append(f'total;dur={duration * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    if app.config['SLOW_REQUEST_PROFILE_MS']:
+        samples = profiler.stop()
+        if samples and duration * 1000 >= app.config['SLOW_REQUEST_PROFILE_MS']:
+            top_stacks = '\n'.join(f'{count} {stack}' for stack, count in samples.most_common(10))
+            logger.warning("Slow request %s %s took %.1fms with %s queries; sampled stacks:\n%s",
+                           request.method, request.path, duration * 1000, stats.queries, top_stacks)
+    return response
+
+@app.teardown_request
+def cleanup_request_instrumentation(error=None):
+    # after_request is skipped when a view raises; make sure nothing leaks into the next request
+    end_request()
+    profiler.stop()
+
+@app.before_request
+def require_schema():
+    # Until the unique indexes exist, bookings and sign-ups fail instead of admitting duplicates.
+    # Registered after the request-id hook so the 503 still carries X-Request-ID.
+    if request.endpoint in PROBE_ENDPOINTS or schema.ready:
+        return
+    if not schema.ensure():
+        return jsonify({'error': 'Service unavailable'}), 503
+
+# Password hashing runs on its own process pool and sheds load with 429 when saturated
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    queue_size=app.config['PASSWORD_HASH_QUEUE']
+)
+
+def hasher_busy_response():
+    logger.warning("Password hashing pool saturated: %s", password_hasher.stats())
+    response = jsonify({'error': 'Too many requests, please retry shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 429
+
+def hasher_unavailable_response():
+    logger.error("Password hashing pool unavailable: %s", password_hasher.stats())
+    response = jsonify({'error': 'Service unavailable'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Token-bucket rate limits: token_required charges the user's bucket, every other
+# route is charged to the client IP before the view runs
+rate_limiter = RateLimiter(
+    MemoryBucketStore(maxsize=app.config['RATE_LIMIT_MAX_KEYS']),
+    app.config['RATE_LIMIT_DEFAULT'],
+    app.config['RATE_LIMITS']
+)
+
+def enforce_rate_limit(client):
+    """Charge the current request to client's bucket for this route; returns a 429 response if it is empty."""
+    if not app.config['RATE_LIMIT_ENABLED'] or request.endpoint in app.config['RATE_LIMIT_EXEMPT']:
+        return None
+    result = rate_limiter.hit(request.endpoint, client)
+    if result is None:
+        return None
+    g.rate_limit = result
+    if result.allowed:
+        return None
+    logger.warning("Rate limit exceeded on %s by %s", request.endpoint, client)
+    return jsonify({'error': 'Too many requests, please retry shortly'}), 429
+
+@app.before_request
+def limit_public_routes():
+    view = app.view_functions.get(request.endpoint)
+    if view is None or request.method == 'OPTIONS' or getattr(view, 'requires_token', False):
+        return None
+    return enforce_rate_limit(f'ip:{request.remote_addr}')
+
+@app.after_request
+def add_rate_limit_headers(response):
+    result = g.get('rate_limit')
+    if result is not None:
+        for header, value in result.headers().items():
+            response.headers[header] = value
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: never touches the database, so a slow MongoDB does not restart workers
+    return jsonify({
+        'status': 'ok',
+        'mongo_connected': mongo.connected,
+        'pool': pool_monitor.stats()
+    }), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    timeout = app.config['READINESS_TIMEOUT_MS'] / 1000
+    try:
+        with pymongo.timeout(timeout):
+            latency = storage.ping()
+    except Exception as e:
+        logger.warning("Readiness check failed: %s", e)
+        return jsonify({'status': 'unavailable', 'error': str(e), 'pool': pool_monitor.stats()}), 503
+    # Outside the ping timeout: building a missing index can take longer
+    if not schema.ensure():
+        logger.warning("Readiness check failed: required indexes missing: %s", schema.error)
+        return jsonify({'status': 'unavailable', 'error': schema.error or 'Indexes are being built',
+                        'pool': pool_monitor.stats()}), 503
+    body = {
+        'status': 'ready',
+        'ping_ms': round(latency * 1000, 2),
+        'pool': pool_monitor.stats()
+    }
+    if schema.missing:
+        # Serving, but the queries these back run slower (or, for the text index, fail)
+        body['status'] = 'degraded'
+        body['missing_indexes'] = schema.missing
+    return jsonify(body), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    cache_stats = user_cache.stats()
+    hasher_stats = password_hasher.stats()
+    pool_stats = pool_monitor.stats()
+    extra = [
+        '# HELP physioconnect_user_cache_hits_total Authenticated user cache hits.',
+        '# TYPE physioconnect_user_cache_hits_total counter',
+        f"physioconnect_user_cache_hits_total {cache_stats['hits']}",
+        '# HELP physioconnect_user_cache_misses_total Authenticated user cache misses.',
+        '# TYPE physioconnect_user_cache_misses_total counter',
+        f"physioconnect_user_cache_misses_total {cache_stats['misses']}",
+        '# HELP physioconnect_password_hash_in_flight Hashing operations running or queued.',
+        '# TYPE physioconnect_password_hash_in_flight gauge',
+        f"physioconnect_password_hash_in_flight {hasher_stats['in_flight']}",
+        '# HELP physioconnect_password_hash_capacity Maximum hashing operations in flight.',
+        '# TYPE physioconnect_password_hash_capacity gauge',
+        f"physioconnect_password_hash_capacity {hasher_stats['capacity']}",
+        '# HELP physioconnect_password_hash_completed_total Hashing operations completed.',
+        '# TYPE physioconnect_password_hash_completed_total counter',
+        f"physioconnect_password_hash_completed_total {hasher_stats['completed']}",
+        '# HELP physioconnect_password_hash_rejected_total Hashing operations rejected with 429.',
+        '# TYPE physioconnect_password_hash_rejected_total counter',
+        f"physioconnect_password_hash_rejected_total {hasher_stats['rejected']}",
+        '# HELP physioconnect_mongo_pool_in_use Connections checked out of the MongoDB pool.',
+        '# TYPE physioconnect_mongo_pool_in_use gauge',
+    ]
+    extra += [f'physioconnect_mongo_pool_in_use{{server="{server}"}} {pool["in_use"]}' for server, pool in pool_stats.items()]
+    extra += [
+        '# HELP physioconnect_mongo_pool_waiting Requests waiting for a MongoDB connection.',
+        '# TYPE physioconnect_mongo_pool_waiting gauge',
+    ]
+    extra += [f'physioconnect_mongo_pool_waiting{{server="{server}"}} {pool["waiting"]}' for server, pool in pool_stats.items()]
+    extra += [
+        '# HELP physioconnect_mongo_pool_max_size Configured maximum MongoDB pool size.',
+        '# TYPE physioconnect_mongo_pool_max_size gauge',
+    ]
+    extra += [f'physioconnect_mongo_pool_max_size{{server="{server}"}} {pool["max_size"]}' for server, pool in pool_stats.items()]
+    return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+# Authenticated user cache, keyed by the user_id string carried in the token
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = storage.get_user(storage.parse_id(user_id))
+        if user:
+            user_cache.set(user_id, user)
+    return user
+
+def invalidate_user(user_id):
+    user_cache.invalidate(str(user_id))
+
+class ClaimsUser(dict):
+    """User built from token claims; the full record is loaded on first access to any other field."""
+
+    def __missing__(self, key):
+        user = load_user(str(self['_id']))
+        if not user:
+            raise KeyError(key)
+        self.update(user)
+        return user[key]
+
+# Endpoints that also accept ?access_token=, for browser EventSource which cannot set headers
+QUERY_TOKEN_ENDPOINTS = {'stream_appointment_changes'}
 
 # Token verification decorator
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
+        if not token and request.endpoint in QUERY_TOKEN_ENDPOINTS:
+            token = request.args.get('access_token')
         if not token:
             logger.warning("Token missing in request")
             return jsonify({'error': 'Token is missing'}), 401
@@ -45,9 +434,16 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token.split(" ")[1]
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = users_collection.find_one({'_id': ObjectId(data['user_id'])})
+            # Charged before the user is loaded so a throttled client costs no queries
+            throttled = enforce_rate_limit(f"user:{data['user_id']}")
+            if throttled:
+                return throttled
+            if app.config['TRUST_TOKEN_CLAIMS'] and data.get('role'):
+                current_user = ClaimsUser(_id=storage.parse_id(data['user_id']), role=data['role'])
+            else:
+                current_user = load_user(data['user_id'])
             if not current_user:
-                logger.warning(f"User not found for ID: {data['user_id']}")
+                logger.warning("User not found for ID: %s", data['user_id'])
                 return jsonify({'error': 'User not found'}), 401
         except jwt.ExpiredSignatureError:
             logger.warning("Token expired")
@@ -56,9 +452,11 @@ def token_required(f):
             logger.warning("Invalid token")
             return jsonify({'error': 'Invalid token'}), 401
         except Exception as e:
-            logger.error(f"Token error: {str(e)}")
+            logger.error("Token error: %s", e)
             return jsonify({'error': f'Token error: {str(e)}'}), 401
         return f(current_user, *args, **kwargs)
+    # Tells limit_public_routes that this view is limited per user instead of per IP
+    decorated.requires_token = True
     return decorated
 
 # Role-based access control decorator
@@ -67,12 +465,629 @@ def role_required(role):
         @wraps(f)
         def decorated_function(current_user, *args, **kwargs):
             if current_user['role'] != role:
-                logger.warning(f"Access denied for user ID {current_user['_id']}. Required role: {role}")
+                logger.warning("Access denied for user ID %s. Required role: %s", current_user['_id'], role)
                 return jsonify({'error': f'Access denied. {role} role required'}), 403
             return f(current_user, *args, **kwargs)
         return decorated_function
     return decorator
 
+# Rendered responses for the public doctor endpoints, invalidated by profile writes
+response_cache = ResponseCache(MemoryBackend(
+    maxsize=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+    ttl=app.config['RESPONSE_CACHE_TTL']
+))
+CACHED_HEADERS = ['X-Next-Cursor']
+
+def cached_response(namespace):
+    """Serve a GET view from response_cache with a strong ETag; namespace may be a callable of the view kwargs."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            cache_namespace = namespace(**kwargs) if callable(namespace) else namespace
+            key = request.full_path
+            slot, entry = response_cache.lookup(cache_namespace, key)
+            if entry is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'etag': hashlib.sha256(body).hexdigest(),
+                    'mimetype': response.mimetype,
+                    'headers': {header: response.headers[header] for header in CACHED_HEADERS if header in response.headers}
+                }
+                response_cache.set(slot, entry)
+            else:
+                logger.debug("Response cache hit for %s", key)
+                response = app.response_class(entry['body'], mimetype=entry['mimetype'], headers=entry['headers'])
+            # compress_response keeps the encoded bodies alongside the entry
+            g.response_cache_entry = entry
+            response.set_etag(entry['etag'])
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        return decorated
+    return decorator
+
+@app.after_request
+def compress_response(response):
+    """gzip or Brotli-encode JSON, NDJSON and CSV bodies of at least COMPRESSION_MIN_BYTES."""
+    if (not app.config['COMPRESSION_ENABLED'] or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    body = response.get_data()
+    if len(body) < app.config['COMPRESSION_MIN_BYTES']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    entry = g.get('response_cache_entry')
+    encoded = entry.setdefault('encoded', {}) if entry is not None else {}
+    if encoding not in encoded:
+        encoded[encoding] = compress(body, encoding, app.config['COMPRESSION_LEVEL'], app.config['BROTLI_QUALITY'])
+    response.set_data(encoded[encoding])
+    response.headers['Content-Encoding'] = encoding
+    # The encoded body is a different representation; a weak ETag still revalidates (If-None-Match compares weakly)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def invalidate_doctor_responses(user_id):
+    # Re-renders must not refill the cache from a secondary that has not seen the write yet
+    mark_written('doctors', f'doctor:{user_id}', user_id)
+    response_cache.invalidate('doctors')
+    response_cache.invalidate(f'doctor:{user_id}')
+
+# Read routing. Views decorated with secondary_reads send their queries to secondaries
+# within MONGO_MAX_STALENESS_SECONDS, unless one of the view's scopes (a user id or a
+# cache namespace) was written within READ_YOUR_WRITES_SECONDS, which reads from the primary.
+# The markers must be visible to every worker, so by default they live in MongoDB.
+secondary_read_preference = SecondaryPreferred(max_staleness=app.config['MONGO_MAX_STALENESS_SECONDS'])
+if app.config['READ_YOUR_WRITES_STORE'] == 'mongo':
+    write_markers = MongoBackend(mongo['write_markers'], ttl=app.config['READ_YOUR_WRITES_SECONDS'])
+elif app.config['READ_YOUR_WRITES_STORE'] == 'memory':
+    write_markers = MemoryBackend(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['READ_YOUR_WRITES_SECONDS'])
+else:
+    raise ValueError(f"Unknown READ_YOUR_WRITES_STORE {app.config['READ_YOUR_WRITES_STORE']!r}; use mongo or memory")
+
+def secondary_reads_enabled():
+    return app.config['MONGO_SECONDARY_READS'] and storage.supports_mongo_features
+
+def mark_written(*scopes):
+    # Markers only steer read routing; without it every read already goes to the primary
+    if secondary_reads_enabled():
+        write_markers.set_many({str(scope): True for scope in scopes})
+
+def read_preference_for(scopes):
+    if not secondary_reads_enabled():
+        return None
+    if write_markers.get_many([str(scope) for scope in scopes]):
+        return None
+    return secondary_read_preference
+
+def secondary_reads(scopes):
+    """Route a view's reads to secondaries; scopes is a callable of the view's arguments."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            token = read_preference_var.set(read_preference_for(scopes(*args, **kwargs)))
+            try:
+                return f(*args, **kwargs)
+            finally:
+                read_preference_var.reset(token)
+        return decorated
+    return decorator
+
+def user_scope(current_user, **view_args):
+    return [current_user['_id']]
+
+# Booked-slot bitmaps backing /doctor/<id>/availability
+availability_index = AvailabilityIndex(ttl=app.config['AVAILABILITY_CACHE_TTL'])
+
+# Every appointment mutation is appended here; /appointments/changes and
+# /appointments/stream serve deltas from it instead of full listings
+change_log = ChangeLog(appointment_changes_collection, counters_collection)
+
+def appointments_changed(op, appointments):
+    mark_written(*{appointment[key] for appointment in appointments for key in ('doctor_id', 'user_id')})
+    if not storage.supports_mongo_features:
+        return
+    # The mutation itself has succeeded; a failed log write only costs clients a reload
+    try:
+        change_log.record(op, appointments)
+    except Exception as e:
+        logger.error("Failed to record %s of %s appointments in the change log: %s", op, len(appointments), e)
+
+# Keyset pagination shared by the listing endpoints. The helpers take an optional
+# args mapping so the async entry point (asgi.py) can reuse them.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def parse_pagination(args=None, parse_after=None):
+    """Return (after, limit); parse_after converts a cursor that is not a plain id and raises ValueError."""
+    args = request.args if args is None else args
+    after = args.get('after')
+    if after and parse_after is not None:
+        after = parse_after(after)
+    else:
+        try:
+            after = storage.parse_id(after) if after else None
+        except Exception:
+            raise ValueError('after must be a valid id')
+    return after, parse_limit(args)
+
+def parse_limit(args=None, default=DEFAULT_PAGE_SIZE):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+def parse_min_experience(args=None):
+    args = request.args if args is None else args
+    try:
+        return int(args['min_experience']) if args.get('min_experience') else None
+    except ValueError:
+        raise ValueError('min_experience must be an integer')
+
+def parse_date_range(args=None):
+    args = request.args if args is None else args
+    date_filter = {}
+    for param, op in (('from', '$gte'), ('to', '$lte')):
+        value = args.get(param)
+        if not value:
+            continue
+        try:
+            date_filter[op] = datetime.datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f'{param} must be a date in YYYY-MM-DD format')
+    return date_filter
+
+def split_page(rows, limit, key='_id'):
+    """Trim a limit + 1 fetch to one page; returns (rows, next_cursor)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, str(rows[-1][key])
+    return rows, None
+
+def appointments_query(base_query, args=None):
+    """Build the filter for a keyset-paginated appointment listing; returns (query, limit)."""
+    after, limit = parse_pagination(args)
+    return appointment_listing_filter(base_query, after, parse_date_range(args)), limit
+
+def appointment_listing_filter(base_query, after, date_filter):
+    query = dict(base_query)
+    if date_filter:
+        query['date'] = date_filter
+    if after:
+        query['_id'] = {'$gt': after}
+    return query
+
+# Display fields copied into each appointment at booking, so listings need no joins.
+# Profile changes are pushed into them by the fan-out worker; appointments written
+# before they existed are filled in by `flask backfill-appointment-identities`.
+IDENTITY_FIELDS = ('doctor_name', 'doctor_email', 'patient_name', 'patient_email')
+EMBEDDED_EMAIL_FIELDS = {'doctor_id': 'doctor_email', 'user_id': 'patient_email'}
+# Listings carry only the latest note and a count; the history is served by /appointments/<id>/notes.
+# 'notes' is the pre-migration string field, absent on documents written since.
+APPOINTMENT_LIST_FIELDS = {
+    field: 1 for field in ('doctor_id', 'user_id', 'date', 'time', 'reason', 'status', 'latest_note', 'notes_count', 'notes')
+    + IDENTITY_FIELDS
+}
+
+def paginate_appointments(key, owner_id):
+    """Run a keyset-paginated appointment listing; returns (appointments, next_cursor)."""
+    after, limit = parse_pagination()
+    appointments = storage.list_appointments(key, owner_id, after, limit, parse_date_range())
+    return split_page(appointments, limit)
+
+def identity_ids(appointments, key):
+    """The appointment[key] ids still to be looked up: those whose appointment lacks the embedded fields."""
+    email_field = EMBEDDED_EMAIL_FIELDS[key]
+    return list({
+        ObjectId(appointment[key]) for appointment in appointments
+        if appointment.get(key) and not appointment.get(email_field)
+    })
+
+def resolve_identities(appointments, key, profiles_collection):
+    """Fetch the users and profiles referenced by appointment[key] with one $in query per collection.
+
+    Appointments that already embed the identity fields are skipped, so a page of
+    fully denormalized appointments costs no queries here.
+    """
+    ids = identity_ids(appointments, key)
+    if not ids:
+        return {}, {}
+    users = {user['_id']: user for user in users_collection.find({'_id': {'$in': ids}}, {'email': 1, 'role': 1})}
+    profiles = {
+        profile['user_id']: profile
+        for profile in profiles_collection.find({'user_id': {'$in': ids}}, {'user_id': 1, 'name': 1})
+    }
+    return users, profiles
+
+# Profile names by '<key>:<user id>' ('doctor_id' or 'user_id'), so a booking embeds both
+# names without a lookup; (None,) records that the user has no profile yet
+profile_name_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['PROFILE_NAME_CACHE_TTL'])
+PROFILE_COLLECTIONS = {'doctor_id': doctor_profiles_collection, 'user_id': patient_profiles_collection}
+
+def lookup_emails(user_ids, cached=True):
+    """Emails by user id; users already in user_cache (the booking patient and doctor) cost no query."""
+    emails = {}
+    missing = []
+    for user_id in user_ids:
+        user = user_cache.get(str(user_id)) if cached else None
+        if user is None:
+            missing.append(user_id)
+        else:
+            emails[user_id] = user['email']
+    if missing:
+        for user in users_collection.find({'_id': {'$in': missing}}, {'email': 1}):
+            emails[user['_id']] = user['email']
+    return emails
+
+def lookup_profile_names(key, user_ids, cached=True):
+    """Profile names by user id for the doctors ('doctor_id') or patients ('user_id'), None without a profile."""
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        entry = profile_name_cache.get(f'{key}:{user_id}') if cached else None
+        if entry is None:
+            missing.append(user_id)
+        else:
+            names[user_id] = entry[0]
+    if missing:
+        found = {
+            profile['user_id']: profile['name']
+            for profile in PROFILE_COLLECTIONS[key].find({'user_id': {'$in': missing}}, {'user_id': 1, 'name': 1})
+        }
+        for user_id in missing:
+            names[user_id] = found.get(user_id)
+            profile_name_cache.set(f'{key}:{user_id}', (names[user_id],))
+    return names
+
+def embed_identities(appointments, cached=True):
+    """Set IDENTITY_FIELDS on appointment documents from their doctor's and patient's records.
+
+    With cached, emails and names already held by user_cache and profile_name_cache are
+    reused, so a booking normally adds no queries; only the misses are fetched, one $in
+    per collection.
+    """
+    doctor_ids = {ObjectId(appointment['doctor_id']) for appointment in appointments}
+    patient_ids = {ObjectId(appointment['user_id']) for appointment in appointments}
+    emails = lookup_emails(doctor_ids | patient_ids, cached)
+    doctor_names = lookup_profile_names('doctor_id', doctor_ids, cached)
+    patient_names = lookup_profile_names('user_id', patient_ids, cached)
+    for appointment in appointments:
+        appointment['doctor_name'] = doctor_names.get(ObjectId(appointment['doctor_id']))
+        appointment['doctor_email'] = emails.get(ObjectId(appointment['doctor_id']))
+        appointment['patient_name'] = patient_names.get(ObjectId(appointment['user_id']))
+        appointment['patient_email'] = emails.get(ObjectId(appointment['user_id']))
+    return appointments
+
+# Pushes profile name changes into the appointments that embed them
+fanout = FanOut()
+
+def fan_out_name(key, user_id, name):
+    profile_name_cache.invalidate(f'{key}:{user_id}')
+    if not storage.supports_mongo_features:
+        # The SQL backend joins names at read time; there are no copies to update
+        return
+    field = 'doctor_name' if key == 'doctor_id' else 'patient_name'
+    fanout.submit(f'{field} for {key} {user_id}', appointments_collection, {key: user_id}, {'$set': {field: name}})
+    # Other workers keep embedding their cached name until it expires; once it has,
+    # push the current name again to repair the bookings made in that window
+    fanout.schedule(app.config['PROFILE_NAME_CACHE_TTL'], (key, user_id), repair_embedded_name, key, user_id)
+
+def repair_embedded_name(key, user_id):
+    field = 'doctor_name' if key == 'doctor_id' else 'patient_name'
+    try:
+        profile = PROFILE_COLLECTIONS[key].find_one({'user_id': user_id}, {'name': 1})
+    except Exception as e:
+        logger.error("Could not re-read the %s of %s %s: %s", field, key, user_id, e)
+        return
+    if profile:
+        fanout.submit(f'{field} repair for {key} {user_id}', appointments_collection,
+                      {key: user_id, field: {'$ne': profile['name']}}, {'$set': {field: profile['name']}})
+
+def doctor_listing_args(args=None):
+    """Parse the /doctors query parameters; returns (after, limit, specialty, min_experience)."""
+    args = request.args if args is None else args
+    after, limit = parse_pagination(args)
+    min_experience = parse_min_experience(args)
+    specialty = args.get('specialty')
+    logger.info("Fetching doctors after=%s limit=%s specialty=%s min_experience=%s", after, limit, specialty, min_experience)
+    return after, limit, specialty, min_experience
+
+def doctors_pipeline(args=None):
+    """Build the joined, paged /doctors aggregation; returns (pipeline, limit)."""
+    after, limit, specialty, min_experience = doctor_listing_args(args)
+    return doctors_page_pipeline(after, limit, specialty, min_experience), limit
+
+def doctors_page_pipeline(after, limit, specialty=None, min_experience=None):
+    match = {}
+    if after:
+        match['user_id'] = {'$gt': after}
+    if specialty:
+        match['specialty'] = specialty
+    if min_experience is not None:
+        match['experience'] = {'$gte': min_experience}
+    # One round trip: profiles are joined to their users server-side and
+    # paged by user_id so the cost of a page does not depend on its offset.
+    pipeline = [
+        {'$match': match},
+        {'$sort': {'user_id': 1}},
+        {'$limit': limit + 1},
+    ] + join_doctor_users()
+    return pipeline
+
+def join_doctor_users(extra_fields=None):
+    """Stages joining a page of doctor profiles to their user records."""
+    projection = dict(serializers.doctor_summary.projection, _id=0, email='$user.email', role='$user.role')
+    projection.update(extra_fields or {})
+    return [
+        {'$lookup': {
+            'from': users_collection.name,
+            'localField': 'user_id',
+            'foreignField': '_id',
+            'as': 'user'
+        }},
+        {'$unwind': {'path': '$user', 'preserveNullAndEmptyArrays': True}},
+        {'$project': projection}
+    ]
+
+MAX_SEARCH_QUERY_LENGTH = 200
+
+def parse_search_cursor(after):
+    """Split a ranked search cursor '<score>_<user_id>' into (score, ObjectId)."""
+    try:
+        score, user_id = after.rsplit('_', 1)
+        return float(score), ObjectId(user_id)
+    except Exception:
+        raise ValueError('after must be a cursor returned by /doctors/search')
+
+def doctor_search_pipeline(args=None):
+    """Build the /doctors/search aggregations; returns (pipeline, facets_pipeline, limit, ranked).
+
+    With q, profiles are matched through the doctor_search text index and ranked by
+    text score; without it they are listed by user_id like /doctors. Every filter is in
+    the leading $match so it can use an index. Specialty facet counts ignore the
+    specialty filter so clients can show the alternatives; they come from a separate
+    aggregation, cached by search_facets.
+    """
+    args = request.args if args is None else args
+    q = (args.get('q') or '').strip()
+    if len(q) > MAX_SEARCH_QUERY_LENGTH:
+        raise ValueError(f'q must not exceed {MAX_SEARCH_QUERY_LENGTH} characters')
+    specialty = args.get('specialty')
+    min_experience = parse_min_experience(args)
+    after, limit = parse_pagination(args, parse_search_cursor if q else None)
+    logger.info("Searching doctors q=%r specialty=%s min_experience=%s after=%s limit=%s",
+                q, specialty, min_experience, after, limit)
+
+    facet_match = {}
+    if q:
+        facet_match['$text'] = {'$search': q}
+    if min_experience is not None:
+        facet_match['experience'] = {'$gte': min_experience}
+    facets_pipeline = [
+        {'$match': facet_match},
+        {'$group': {'_id': '$specialty', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1, '_id': 1}}
+    ]
+
+    match = dict(facet_match)
+    if specialty:
+        match['specialty'] = specialty
+    if q:
+        pipeline = [{'$match': match}, {'$addFields': {'score': {'$meta': 'textScore'}}}]
+        if after:
+            after_score, after_id = after
+            pipeline.append({'$match': {'$or': [
+                {'score': {'$lt': after_score}},
+                {'score': after_score, 'user_id': {'$gt': after_id}}
+            ]}})
+        pipeline.append({'$sort': {'score': -1, 'user_id': 1}})
+    else:
+        if after:
+            match['user_id'] = {'$gt': after}
+        pipeline = [{'$match': match}, {'$sort': {'user_id': 1}}]
+    pipeline.append({'$limit': limit + 1})
+    pipeline += join_doctor_users({'score': 1} if q else None)
+    return pipeline, facets_pipeline, limit, bool(q)
+
+def search_facets(facets_pipeline):
+    """Specialty counts for a search; cached in the 'doctors' namespace, so profile writes refresh them."""
+    slot, facets = response_cache.lookup('doctors', f'facets:{facets_pipeline[0]["$match"]!r}')
+    if facets is None:
+        facets = [
+            {'specialty': facet['_id'], 'count': facet['count']}
+            for facet in doctor_profiles_collection.aggregate(facets_pipeline) if facet['_id']
+        ]
+        response_cache.set(slot, facets)
+    return facets
+
+def format_doctors(profiles):
+    doctors = []
+    for profile in profiles:
+        # Orphaned profiles are skipped after paging so the cursor stays exact
+        if profile.get('role') != 'doctor':
+            continue
+        doctors.append(serializers.doctor_summary(profile))
+    return doctors
+
+def format_doctor_appointments(appointments, patients, patient_profiles):
+    formatted_appointments = []
+    for appointment in appointments:
+        try:
+            if not all([appointment.get('date'), appointment.get('time'), appointment.get('reason')]):
+                row_logger.warning("Invalid appointment data for ID: %s - missing required fields", appointment['_id'])
+                continue
+            if appointment.get('patient_email'):
+                patient_email = appointment['patient_email']
+                patient_name = appointment.get('patient_name') or patient_email
+            else:
+                patient = patients.get(ObjectId(appointment['user_id']))
+                if not patient:
+                    row_logger.warning("Patient not found for user_id: %s in appointment ID: %s", appointment['user_id'], appointment['_id'])
+                    continue
+                patient_profile = patient_profiles.get(ObjectId(appointment['user_id']))
+                patient_email = patient['email']
+                patient_name = patient_profile['name'] if patient_profile else patient['email']
+            formatted_appointments.append(serializers.doctor_appointment(
+                appointment, patient_name=patient_name, patient_email=patient_email, **note_summary(appointment)
+            ))
+        except Exception as e:
+            row_logger.error("Error processing appointment ID %s: %s", appointment['_id'], e)
+            continue
+    return formatted_appointments
+
+def format_patient_appointments(appointments, doctors, doctor_profiles):
+    formatted_appointments = []
+    for appointment in appointments:
+        if appointment.get('doctor_email'):
+            doctor_email = appointment['doctor_email']
+            doctor_name = appointment.get('doctor_name') or 'Unknown'
+        else:
+            doctor = doctors.get(ObjectId(appointment['doctor_id']))
+            doctor_profile = doctor_profiles.get(ObjectId(appointment['doctor_id']))
+            doctor_email = doctor['email'] if doctor else 'Unknown'
+            doctor_name = doctor_profile['name'] if doctor_profile else 'Unknown'
+        formatted_appointments.append(serializers.patient_appointment(
+            appointment, doctor_name=doctor_name, doctor_email=doctor_email, **note_summary(appointment)
+        ))
+    return formatted_appointments
+
+class MongoStorage(Storage):
+    """The MongoDB queries behind the routes SQLStorage also serves."""
+
+    supports_mongo_features = True
+
+    def parse_id(self, value):
+        return ObjectId(value)
+
+    def ensure_schema(self):
+        return ensure_indexes(mongo.db)
+
+    def ping(self):
+        return mongo.ping()
+
+    def get_user(self, user_id):
+        return users_collection.find_one({'_id': user_id}, {'password': 0})
+
+    def find_user_by_email(self, email):
+        return users_collection.find_one({'email': email})
+
+    def create_user(self, user):
+        return users_collection.insert_one(user).inserted_id
+
+    def replace_password(self, user, password):
+        users_collection.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': password}})
+
+    def list_doctors(self, after, limit, specialty=None, min_experience=None):
+        return list(doctor_profiles_collection.aggregate(doctors_page_pipeline(after, limit, specialty, min_experience)))
+
+    def find_doctor_profile(self, user_id, projection=None):
+        return doctor_profiles_collection.find_one({'user_id': user_id}, projection)
+
+    def get_doctor_profile(self, profile_id, projection=None):
+        return doctor_profiles_collection.find_one({'_id': profile_id}, projection)
+
+    def create_doctor_profile(self, profile):
+        return doctor_profiles_collection.insert_one(profile).inserted_id
+
+    def update_doctor_profile(self, profile_id, fields):
+        doctor_profiles_collection.update_one({'_id': profile_id}, {'$set': fields})
+
+    def find_patient_profile(self, user_id, projection=None):
+        return patient_profiles_collection.find_one({'user_id': user_id}, projection)
+
+    def create_patient_profile(self, profile):
+        return patient_profiles_collection.insert_one(profile).inserted_id
+
+    def list_appointments(self, key, owner_id, after, limit, date_filter=None):
+        query = appointment_listing_filter({key: owner_id}, after, date_filter)
+        return list(appointments_collection.find(query, APPOINTMENT_LIST_FIELDS).sort('_id', 1).limit(limit + 1))
+
+    def resolve_identities(self, appointments, key):
+        profiles_collection = doctor_profiles_collection if key == 'doctor_id' else patient_profiles_collection
+        return resolve_identities(appointments, key, profiles_collection)
+
+    def booked_slots(self, doctor_id, first, last):
+        return appointments_collection.find(
+            {'doctor_id': doctor_id, 'date': {'$gte': first, '$lte': last}},
+            {'_id': 0, 'date': 1, 'time': 1}
+        )
+
+    def create_appointment(self, appointment):
+        embed_identities([appointment])
+        # The unique (doctor_id, date, time) index rejects a slot that is already
+        # booked, so no separate existence check is needed
+        try:
+            return appointments_collection.insert_one(appointment).inserted_id
+        except DuplicateKeyError:
+            raise SlotTaken()
+
+    def get_appointment(self, appointment_id):
+        return appointments_collection.find_one(
+            {'_id': appointment_id},
+            {'doctor_id': 1, 'user_id': 1, 'date': 1, 'time': 1, 'status': 1}
+        )
+
+    def list_appointment_notes(self, appointment_id, offset, limit):
+        appointment = appointments_collection.find_one(
+            {'_id': appointment_id},
+            {'doctor_id': 1, 'user_id': 1, 'notes': 1, 'notes_count': 1,
+             'note_entries': {'$slice': [offset, limit + 1]}}
+        )
+        if not appointment:
+            return None, [], 0
+        legacy = legacy_notes(appointment['notes']) if isinstance(appointment.get('notes'), str) else []
+        if legacy:
+            # Not yet migrated: the legacy lines come first, so page over the whole history
+            entries = appointments_collection.find_one({'_id': appointment_id}, {'note_entries': 1}).get('note_entries', [])
+            notes = (legacy + entries)[offset:offset + limit + 1]
+        else:
+            notes = appointment.get('note_entries', [])
+        return appointment, notes, appointment.get('notes_count', 0) + len(legacy)
+
+    def update_appointment_status(self, appointment_id, status, note=None):
+        update = {'$set': {'status': status}}
+        if note:
+            add_note(update, note)
+        appointments_collection.update_one({'_id': appointment_id}, update)
+
+    def delete_appointment(self, appointment_id):
+        appointments_collection.delete_one({'_id': appointment_id})
+
+# STORAGE_BACKEND=sql serves the core routes from SQLAlchemy (see sqlstorage.py) for
+# deployments without MongoDB; the routes in MONGO_ONLY_ENDPOINTS then answer 501.
+if app.config['STORAGE_BACKEND'] == 'sql':
+    from models import db as sql_db
+    from sqlstorage import SQLStorage
+    sql_db.init_app(app)
+    storage = SQLStorage(sql_db)
+elif app.config['STORAGE_BACKEND'] == 'mongo':
+    storage = MongoStorage()
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND {app.config['STORAGE_BACKEND']!r}; use mongo or sql")
+
+MONGO_ONLY_ENDPOINTS = {
+    'search_doctors', 'export_doctor_appointments', 'bulk_update_appointment_status',
+    'bulk_create_appointments', 'get_appointment_changes',
+    'stream_appointment_changes'
+}
+
+@app.before_request
+def reject_mongo_only_routes():
+    if not storage.supports_mongo_features and request.endpoint in MONGO_ONLY_ENDPOINTS:
+        return jsonify({'error': f'Not available with the {app.config["STORAGE_BACKEND"]} storage backend'}), 501
+
 # Routes
 @app.route('/signin', methods=['POST'])
 def signin():
@@ -81,16 +1096,30 @@ def signin():
         if not data or not data.get('email') or not data.get('password'):
             logger.warning("Missing email or password in signin request")
             return jsonify({'error': 'Email and password are required'}), 400
-        user = users_collection.find_one({'email': data.get('email')})
-        if not user or not check_password_hash(user['password'], data.get('password')):
-            logger.warning(f"Invalid credentials for email: {data.get('email')}")
+        user = storage.find_user_by_email(data.get('email'))
+        try:
+            valid = bool(user) and password_hasher.verify(user['password'], data.get('password'))
+        except HasherSaturated:
+            return hasher_busy_response()
+        except HasherUnavailable:
+            return hasher_unavailable_response()
+        if not valid:
+            logger.warning("Invalid credentials for email: %s", data.get('email'))
             return jsonify({'error': 'Invalid credentials'}), 401
+        if password_hasher.needs_rehash(user['password']):
+            try:
+                storage.replace_password(user, password_hasher.hash(data.get('password')))
+                invalidate_user(user['_id'])
+                logger.info("Upgraded password hash for user ID: %s", user['_id'])
+            except (HasherSaturated, HasherUnavailable):
+                # The upgrade is retried on a later sign-in
+                pass
         token = jwt.encode({
             'user_id': str(user['_id']),
             'role': user['role'],
             'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
         }, app.config['SECRET_KEY'], algorithm="HS256")
-        logger.info(f"User {user['email']} signed in successfully")
+        logger.info("User %s signed in successfully", user['email'])
         return jsonify({
             'access_token': token,
             'role': user['role'],
@@ -101,7 +1130,7 @@ def signin():
             }
         }), 200
     except Exception as e:
-        logger.error(f"Signin error: {str(e)}")
+        logger.error("Signin error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/signup', methods=['POST'])
@@ -111,58 +1140,94 @@ def signup():
         if not data or not data.get('email') or not data.get('password'):
             logger.warning("Missing email or password in signup request")
             return jsonify({'error': 'Email and password are required'}), 400
-        existing_user = users_collection.find_one({'email': data.get('email')})
+        existing_user = storage.find_user_by_email(data.get('email'))
         if existing_user:
-            logger.warning(f"User already exists: {data.get('email')}")
+            logger.warning("User already exists: %s", data.get('email'))
             return jsonify({'error': 'User already exists'}), 400
-        hashed_password = generate_password_hash(data.get('password'))
+        try:
+            hashed_password = password_hasher.hash(data.get('password'))
+        except HasherSaturated:
+            return hasher_busy_response()
+        except HasherUnavailable:
+            return hasher_unavailable_response()
         new_user = {
             'email': data.get('email'),
             'password': hashed_password,
             'role': data.get('role', 'user'),
             'created_at': datetime.datetime.utcnow()
         }
-        result = users_collection.insert_one(new_user)
+        user_id = storage.create_user(new_user)
+        invalidate_user(user_id)
         token = jwt.encode({
-            'user_id': str(result.inserted_id),
+            'user_id': str(user_id),
             'role': new_user['role'],
             'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
         }, app.config['SECRET_KEY'], algorithm="HS256")
-        logger.info(f"User {new_user['email']} signed up successfully")
+        logger.info("User %s signed up successfully", new_user['email'])
         return jsonify({
             'access_token': token,
             'role': new_user['role'],
             'user': {
-                'id': str(result.inserted_id),
+                'id': str(user_id),
                 'email': new_user['email'],
                 'role': new_user['role']
             }
         }), 201
     except Exception as e:
-        logger.error(f"Signup error: {str(e)}")
+        logger.error("Signup error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/doctors', methods=['GET'])
+@cached_response('doctors')
+@secondary_reads(lambda: ['doctors'])
 def get_doctors():
     try:
-        logger.info("Fetching all doctors")
-        doctor_profiles = doctor_profiles_collection.find()
-        doctors = []
-        for profile in doctor_profiles:
-            doctor = users_collection.find_one({'_id': ObjectId(profile['user_id']), 'role': 'doctor'})
-            if doctor:
-                doctors.append({
-                    'id': str(profile['user_id']),
-                    'name': profile['name'],
-                    'specialty': profile.get('specialty', ''),
-                    'bio': profile.get('bio', ''),
-                    'experience': profile.get('experience', 0),
-                    'email': doctor['email']
-                })
-        logger.info(f"Returning {len(doctors)} doctors")
-        return jsonify(doctors), 200
+        after, limit, specialty, min_experience = doctor_listing_args()
+    except ValueError as e:
+        logger.warning("Invalid doctor listing parameters: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        profiles, next_cursor = split_page(storage.list_doctors(after, limit, specialty, min_experience), limit, key='user_id')
+        doctors = format_doctors(profiles)
+        logger.info("Returning %s doctors", len(doctors))
+        response = jsonify(doctors)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    except Exception as e:
+        logger.error("Get doctors error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/doctors/search', methods=['GET'])
+@cached_response('doctors')
+@secondary_reads(lambda: ['doctors'])
+def search_doctors():
+    try:
+        pipeline, facets_pipeline, limit, ranked = doctor_search_pipeline()
+    except ValueError as e:
+        logger.warning("Invalid doctor search parameters: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        profiles = list(doctor_profiles_collection.aggregate(pipeline))
+        if len(profiles) > limit:
+            profiles = profiles[:limit]
+            last = profiles[-1]
+            next_cursor = f"{last['score']!r}_{last['user_id']}" if ranked else str(last['user_id'])
+        else:
+            next_cursor = None
+        doctors = format_doctors(profiles)
+        if ranked:
+            scores = {str(profile['user_id']): profile['score'] for profile in profiles}
+            for doctor in doctors:
+                doctor['score'] = round(scores[doctor['id']], 4)
+        facets = search_facets(facets_pipeline)
+        logger.info("Returning %s doctors from search", len(doctors))
+        response = jsonify({'results': doctors, 'facets': {'specialty': facets}})
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     except Exception as e:
-        logger.error(f"Get doctors error: {str(e)}")
+        logger.error("Doctor search error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/doctor/add-profile', methods=['POST'])
@@ -171,65 +1236,110 @@ def get_doctors():
 def add_doctor_profile(current_user):
     try:
         data = request.get_json()
-        existing_profile = doctor_profiles_collection.find_one({'user_id': current_user['_id']})
+        schedule_error = validate_schedule(data.get('working_hours'), data.get('slot_minutes'))
+        if schedule_error:
+            logger.warning("Invalid schedule for doctor ID %s: %s", current_user['_id'], schedule_error)
+            return jsonify({'error': schedule_error}), 400
+        existing_profile = storage.find_doctor_profile(current_user['_id'], {'_id': 1})
         if existing_profile:
-            logger.warning(f"Profile already exists for doctor ID: {current_user['_id']}")
+            logger.warning("Profile already exists for doctor ID: %s", current_user['_id'])
             return jsonify({'error': 'Profile already exists for this doctor'}), 400
         new_profile = {
             'user_id': current_user['_id'],
             'name': data.get('name', ''),
             'specialty': data.get('specialty', ''),
             'bio': data.get('bio', ''),
-            'experience': data.get('experience', 0)
+            'experience': data.get('experience', 0),
+            'working_hours': data.get('working_hours', DEFAULT_WORKING_HOURS),
+            'slot_minutes': data.get('slot_minutes', DEFAULT_SLOT_MINUTES)
         }
-        result = doctor_profiles_collection.insert_one(new_profile)
-        logger.info(f"Doctor profile created for user ID: {current_user['_id']}")
+        profile_id = storage.create_doctor_profile(new_profile)
+        invalidate_doctor_responses(current_user['_id'])
+        fan_out_name('doctor_id', current_user['_id'], new_profile['name'])
+        logger.info("Doctor profile created for user ID: %s", current_user['_id'])
         return jsonify({
             'message': 'Doctor profile created successfully',
-            'profileId': str(result.inserted_id)
+            'profileId': str(profile_id)
         }), 201
     except Exception as e:
-        logger.error(f"Add doctor profile error: {str(e)}")
+        logger.error("Add doctor profile error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/doctor/<id>', methods=['GET'])
+@cached_response(lambda id: f'doctor:{id}')
+@secondary_reads(lambda id: [f'doctor:{id}'])
 def get_doctor_profile(id):
     try:
-        logger.info(f"Fetching doctor profile for ID: {id}")
-        profile = doctor_profiles_collection.find_one({'user_id': ObjectId(id)})
+        logger.info("Fetching doctor profile for ID: %s", id)
+        profile = storage.find_doctor_profile(storage.parse_id(id), serializers.doctor_detail.projection)
         if not profile:
-            logger.warning(f"Profile not found for user ID: {id}")
+            logger.warning("Profile not found for user ID: %s", id)
             return jsonify({'error': 'Profile not found'}), 404
-        doctor = users_collection.find_one({'_id': ObjectId(id), 'role': 'doctor'})
-        if not doctor:
-            logger.warning(f"Invalid doctor profile for user ID: {id}")
+        doctor = storage.get_user(profile['user_id'])
+        if not doctor or doctor['role'] != 'doctor':
+            logger.warning("Invalid doctor profile for user ID: %s", id)
             return jsonify({'error': 'Invalid doctor profile'}), 400
-        logger.info(f"Returning doctor profile for ID: {id}")
+        logger.info("Returning doctor profile for ID: %s", id)
+        return jsonify(serializers.doctor_detail(profile, email=doctor['email'])), 200
+    except Exception as e:
+        logger.error("Get doctor profile error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/doctor/<id>/availability', methods=['GET'])
+def get_doctor_availability(id):
+    try:
+        doctor_id = storage.parse_id(id)
+    except Exception:
+        logger.warning("Invalid doctor ID: %s", id)
+        return jsonify({'error': 'Doctor ID must be a valid id'}), 400
+    try:
+        today = datetime.datetime.utcnow().date()
+        start = datetime.datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else today
+        end = datetime.datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else start + datetime.timedelta(days=13)
+    except ValueError:
+        logger.warning("Invalid availability date range")
+        return jsonify({'error': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    if end < start or (end - start).days >= MAX_RANGE_DAYS:
+        return jsonify({'error': f'to must be on or after from and span at most {MAX_RANGE_DAYS} days'}), 400
+    try:
+        logger.info("Computing availability for doctor ID: %s from %s to %s", id, start, end)
+        profile = storage.find_doctor_profile(doctor_id, {'working_hours': 1, 'slot_minutes': 1})
+        if not profile:
+            logger.warning("Profile not found for user ID: %s", id)
+            return jsonify({'error': 'Profile not found'}), 404
+        slot_minutes = profile.get('slot_minutes', DEFAULT_SLOT_MINUTES)
+        dates = [(start + datetime.timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range((end - start).days + 1)]
+        booked = availability_index.booked(storage.booked_slots, doctor_id, slot_minutes, dates)
+        days = [
+            {'date': date, 'slots': slots}
+            for date, slots in free_slots(profile.get('working_hours', DEFAULT_WORKING_HOURS), slot_minutes, booked)
+        ]
         return jsonify({
-            'id': str(profile['user_id']),
-            'name': profile['name'],
-            'specialty': profile.get('specialty', ''),
-            'bio': profile.get('bio', ''),
-            'experience': profile.get('experience', 0),
-            'email': doctor['email']
+            'doctor_id': id,
+            'slot_minutes': slot_minutes,
+            'days': days
         }), 200
     except Exception as e:
-        logger.error(f"Get doctor profile error: {str(e)}")
+        logger.error("Get doctor availability error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/doctor/profile/<profile_id>', methods=['PUT'])
 @token_required
 def update_doctor_profile(current_user, profile_id):
     try:
-        logger.info(f"Updating doctor profile ID: {profile_id} for user ID: {current_user['_id']}")
-        profile = doctor_profiles_collection.find_one({'_id': ObjectId(profile_id)})
+        logger.info("Updating doctor profile ID: %s for user ID: %s", profile_id, current_user['_id'])
+        profile = storage.get_doctor_profile(storage.parse_id(profile_id), {'user_id': 1, 'name': 1})
         if not profile:
-            logger.warning(f"Profile not found: {profile_id}")
+            logger.warning("Profile not found: %s", profile_id)
             return jsonify({'error': 'Profile not found'}), 404
         if str(profile['user_id']) != str(current_user['_id']):
-            logger.warning(f"Unauthorized update attempt by user ID: {current_user['_id']}")
+            logger.warning("Unauthorized update attempt by user ID: %s", current_user['_id'])
             return jsonify({'error': 'Unauthorized'}), 403
         data = request.get_json()
+        schedule_error = validate_schedule(data.get('working_hours'), data.get('slot_minutes'))
+        if schedule_error:
+            logger.warning("Invalid schedule for profile ID %s: %s", profile_id, schedule_error)
+            return jsonify({'error': schedule_error}), 400
         update_data = {}
         if 'name' in data:
             update_data['name'] = data['name']
@@ -239,252 +1349,653 @@ def update_doctor_profile(current_user, profile_id):
             update_data['bio'] = data['bio']
         if 'experience' in data:
             update_data['experience'] = data['experience']
+        if 'working_hours' in data:
+            update_data['working_hours'] = data['working_hours']
+        if 'slot_minutes' in data:
+            update_data['slot_minutes'] = data['slot_minutes']
         if update_data:
-            doctor_profiles_collection.update_one(
-                {'_id': ObjectId(profile_id)},
-                {'$set': update_data}
-            )
-        logger.info(f"Doctor profile ID: {profile_id} updated successfully")
-        updated_profile = doctor_profiles_collection.find_one({'_id': ObjectId(profile_id)})
+            storage.update_doctor_profile(profile['_id'], update_data)
+            invalidate_doctor_responses(profile['user_id'])
+            if 'slot_minutes' in update_data:
+                availability_index.invalidate(profile['user_id'])
+            if 'name' in update_data and update_data['name'] != profile.get('name'):
+                fan_out_name('doctor_id', profile['user_id'], update_data['name'])
+        logger.info("Doctor profile ID: %s updated successfully", profile_id)
+        updated_profile = storage.get_doctor_profile(profile['_id'], serializers.doctor_profile_detail.projection)
         return jsonify({
             'message': 'Profile updated successfully',
-            'profile': {
-                'id': str(updated_profile['_id']),
-                'user_id': str(updated_profile['user_id']),
-                'name': updated_profile['name'],
-                'specialty': updated_profile.get('specialty', ''),
-                'bio': updated_profile.get('bio', ''),
-                'experience': updated_profile.get('experience', 0)
-            }
+            'profile': serializers.doctor_profile_detail(updated_profile)
         }), 200
     except Exception as e:
-        logger.error(f"Update doctor profile error: {str(e)}")
+        logger.error("Update doctor profile error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/doctor/appointments', methods=['GET'])
 @token_required
 @role_required('doctor')
+@secondary_reads(user_scope)
 def get_doctor_appointments(current_user):
     try:
-        logger.info(f"Starting get_doctor_appointments for doctor_id: {current_user['_id']}")
-        appointments = appointments_collection.find({'doctor_id': current_user['_id']})
-        formatted_appointments = []
-        for appointment in appointments:
-            try:
-                logger.debug(f"Processing appointment ID: {appointment['_id']}")
-                if not all([appointment.get('date'), appointment.get('time'), appointment.get('reason')]):
-                    logger.warning(f"Invalid appointment data for ID: {appointment['_id']} - missing required fields")
-                    continue
-                patient = users_collection.find_one({'_id': ObjectId(appointment['user_id'])})
-                if not patient:
-                    logger.warning(f"Patient not found for user_id: {appointment['user_id']} in appointment ID: {appointment['_id']}")
-                    continue
-                patient_profile = patient_profiles_collection.find_one({'user_id': ObjectId(appointment['user_id'])})
-                appointment_data = {
-                    'id': str(appointment['_id']),
-                    'user_id': str(appointment['user_id']),
-                    'patient_name': patient_profile['name'] if patient_profile else patient['email'],
-                    'patient_email': patient['email'],
-                    'date': appointment['date'] or 'Unknown',
-                    'time': appointment['time'] or 'Unknown',
-                    'reason': appointment['reason'] or 'Not specified',
-                    'status': appointment['status'] or 'pending',
-                    'notes': appointment['notes'] or ''
-                }
-                formatted_appointments.append(appointment_data)
-                logger.debug(f"Successfully processed appointment ID: {appointment['_id']}")
-            except Exception as e:
-                logger.error(f"Error processing appointment ID {appointment['_id']}: {str(e)}")
-                continue
-        logger.info(f"Returning {len(formatted_appointments)} formatted appointments")
-        return jsonify(formatted_appointments), 200
+        appointments, next_cursor = paginate_appointments('doctor_id', current_user['_id'])
+    except ValueError as e:
+        logger.warning("Invalid appointment query parameters: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        logger.info("Starting get_doctor_appointments for doctor_id: %s", current_user['_id'])
+        patients, patient_profiles = storage.resolve_identities(appointments, 'user_id')
+        formatted_appointments = format_doctor_appointments(appointments, patients, patient_profiles)
+        logger.info("Returning %s formatted appointments", len(formatted_appointments))
+        response = jsonify(formatted_appointments)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     except Exception as e:
-        logger.error(f"Critical error in get_doctor_appointments: {str(e)}")
+        logger.error("Critical error in get_doctor_appointments: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+EXPORT_BATCH_SIZE = 500
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_COLUMNS = ['id', 'user_id', 'patient_name', 'patient_email', 'date', 'time', 'reason', 'status', 'notes_count', 'latest_note']
+
+def csv_safe(value):
+    # Spreadsheets evaluate cells starting with these characters as formulas
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+def render_export_rows(rows, export_format):
+    if export_format == 'ndjson':
+        return ''.join(json_provider.dumps(row) + '\n' for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        latest_note = row['latest_note']['text'] if row['latest_note'] else ''
+        writer.writerow([csv_safe(latest_note if column == 'latest_note' else row[column]) for column in EXPORT_COLUMNS])
+    return buffer.getvalue()
+
+@app.route('/doctor/appointments/export', methods=['GET'])
+@token_required
+@role_required('doctor')
+def export_doctor_appointments(current_user):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        logger.warning("Invalid export format: %s", export_format)
+        return jsonify({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    try:
+        date_filter = parse_date_range()
+    except ValueError as e:
+        logger.warning("Invalid export date range: %s", e)
+        return jsonify({'error': str(e)}), 400
+    query = {'doctor_id': current_user['_id']}
+    if date_filter:
+        query['date'] = date_filter
+    # The body is produced after the view returns, so the read routing is applied by the generator
+    read_preference = read_preference_for(user_scope(current_user))
+    logger.info("Exporting appointments for doctor ID %s as %s", current_user['_id'], export_format)
+
+    def batches(cursor):
+        batch = []
+        for appointment in cursor:
+            batch.append(appointment)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def generate():
+        token = read_preference_var.set(read_preference)
+        exported = 0
+        try:
+            if export_format == 'csv':
+                yield ','.join(EXPORT_COLUMNS) + '\r\n'
+            # (doctor_id, date, time) index order, so the server streams without an in-memory sort
+            cursor = appointments_collection.find(query, APPOINTMENT_LIST_FIELDS).sort(
+                [('date', 1), ('time', 1)]).batch_size(EXPORT_BATCH_SIZE)
+            # Only one batch of appointments and their identities is held at a time
+            for batch in batches(cursor):
+                patients, patient_profiles = resolve_identities(batch, 'user_id', patient_profiles_collection)
+                rows = format_doctor_appointments(batch, patients, patient_profiles)
+                exported += len(rows)
+                yield render_export_rows(rows, export_format)
+            logger.info("Exported %s appointments for doctor ID %s", exported, current_user['_id'])
+        except Exception as e:
+            # Headers are already sent; aborting the body tells the client the export is incomplete
+            logger.error("Export failed for doctor ID %s after %s rows: %s", current_user['_id'], exported, e)
+            raise
+        finally:
+            read_preference_var.reset(token)
+
+    filename = f"appointments-{datetime.datetime.utcnow().strftime('%Y%m%d')}.{export_format}"
+    return Response(generate(), mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/patient/appointments', methods=['GET'])
 @token_required
+@secondary_reads(user_scope)
 def get_patient_appointments(current_user):
     try:
-        logger.info(f"Fetching patient appointments for user_id: {current_user['_id']}")
-        appointments = appointments_collection.find({'user_id': current_user['_id']})
-        formatted_appointments = []
-        for appointment in appointments:
-            doctor = users_collection.find_one({'_id': ObjectId(appointment['doctor_id'])})
-            doctor_profile = doctor_profiles_collection.find_one({'user_id': ObjectId(appointment['doctor_id'])})
-            formatted_appointments.append({
-                'id': str(appointment['_id']),
-                'doctor_id': str(appointment['doctor_id']),
-                'doctor_name': doctor_profile['name'] if doctor_profile else 'Unknown',
-                'doctor_email': doctor['email'] if doctor else 'Unknown',
-                'date': appointment['date'] or 'Unknown',
-                'time': appointment['time'] or 'Unknown',
-                'reason': appointment['reason'] or 'Not specified',
-                'status': appointment['status'] or 'pending',
-                'notes': appointment['notes'] or ''
-            })
-        logger.info(f"Returning {len(formatted_appointments)} patient appointments")
-        return jsonify(formatted_appointments), 200
+        appointments, next_cursor = paginate_appointments('user_id', current_user['_id'])
+    except ValueError as e:
+        logger.warning("Invalid appointment query parameters: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        logger.info("Fetching patient appointments for user_id: %s", current_user['_id'])
+        doctors, doctor_profiles = storage.resolve_identities(appointments, 'doctor_id')
+        formatted_appointments = format_patient_appointments(appointments, doctors, doctor_profiles)
+        logger.info("Returning %s patient appointments", len(formatted_appointments))
+        response = jsonify(formatted_appointments)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     except Exception as e:
-        logger.error(f"Error in get_patient_appointments: {str(e)}")
+        logger.error("Error in get_patient_appointments: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
+VALID_STATUSES = ['pending', 'accepted', 'declined', 'completed', 'cancelled']
+MAX_BULK_SIZE = 100
+
+def check_appointment_access(current_user, appointment):
+    """Return an error message if current_user may not modify the appointment, else None."""
+    if current_user['role'] == 'doctor' and str(appointment['doctor_id']) != str(current_user['_id']):
+        return 'Unauthorized. Not your appointment'
+    elif current_user['role'] == 'user' and str(appointment['user_id']) != str(current_user['_id']):
+        return 'Unauthorized. Not your appointment'
+    return None
+
+# Notes are an array of entries appended with $push, so adding one needs no read and
+# concurrent notes are never lost. Appointments written before the switch hold a single
+# 'notes' string of "[YYYY-MM-DD HH:MM] text" lines until `flask migrate-notes` runs.
+MAX_NOTE_LENGTH = 1000
+LEGACY_NOTE_LINE = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2})\] (.*)$')
+
+def validate_note(note):
+    if note is not None and not isinstance(note, str):
+        return 'Notes must be a string'
+    if note and len(note) > MAX_NOTE_LENGTH:
+        return f'Notes must not exceed {MAX_NOTE_LENGTH} characters'
+    return None
+
+def new_note(current_user, text):
+    return {
+        'id': ObjectId(),
+        'text': text,
+        'author_id': current_user['_id'],
+        'author_role': current_user['role'],
+        'created_at': datetime.datetime.utcnow()
+    }
+
+def add_note(update, note):
+    """Extend an update document to append note, keeping at most APPOINTMENT_NOTES_CAP entries."""
+    cap = app.config['APPOINTMENT_NOTES_CAP']
+    update.setdefault('$push', {})['note_entries'] = {'$each': [note], '$slice': -cap} if cap else note
+    update.setdefault('$inc', {})['notes_count'] = 1
+    update.setdefault('$set', {})['latest_note'] = note
+    return update
+
+def legacy_notes(notes):
+    """Split a pre-migration notes string into note entries."""
+    entries = []
+    for line in (notes or '').splitlines():
+        if not line.strip():
+            continue
+        match = LEGACY_NOTE_LINE.match(line)
+        entries.append({
+            'id': None,
+            'text': match.group(2) if match else line,
+            'author_id': None,
+            'author_role': None,
+            'created_at': datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H:%M') if match else None
+        })
+    return entries
+
+def format_note(note):
+    if not note:
+        return None
+    return serializers.note(note)
+
+def note_summary(appointment):
+    """The latest_note and notes_count fields of a listing row."""
+    legacy = legacy_notes(appointment.get('notes')) if isinstance(appointment.get('notes'), str) else []
+    latest = appointment.get('latest_note') or (legacy[-1] if legacy else None)
+    return {
+        'latest_note': format_note(latest),
+        'notes_count': appointment.get('notes_count', 0) + len(legacy)
+    }
+
+def build_appointment(current_user, data):
+    """Validate a booking payload; returns (appointment, None, None) or (None, error, status_code)."""
+    required_fields = ['doctor_id', 'date', 'time', 'reason']
+    missing_fields = [field for field in required_fields if not data.get(field)]
+    if missing_fields:
+        logger.warning("Missing required fields: %s", missing_fields)
+        return None, f'Missing required fields: {", ".join(missing_fields)}', 400
+
+    # Validate doctor_id
+    try:
+        doctor_id = storage.parse_id(data.get('doctor_id'))
+    except Exception:
+        logger.warning("Invalid doctor_id: %s", data.get('doctor_id'))
+        return None, 'Doctor ID must be a valid id', 400
+
+    # Check if doctor exists and has correct role (served from the user cache)
+    doctor = load_user(str(doctor_id))
+    if not doctor or doctor['role'] != 'doctor':
+        logger.warning("Doctor not found or invalid role for ID: %s", doctor_id)
+        return None, 'Doctor not found or invalid', 404
+
+    # Validate date and time
+    try:
+        appointment_date = datetime.datetime.strptime(data.get('date'), '%Y-%m-%d').strftime('%Y-%m-%d')
+        appointment_time = datetime.datetime.strptime(data.get('time'), '%H:%M').strftime('%H:%M')
+    except ValueError as e:
+        logger.warning("Invalid date or time format: %s", e)
+        return None, 'Invalid date or time format. Use YYYY-MM-DD for date and HH:MM for time', 400
+
+    # Validate reason length
+    if len(data.get('reason')) > 200:
+        logger.warning("Reason exceeds maximum length of 200 characters")
+        return None, 'Reason must not exceed 200 characters', 400
+
+    note_error = validate_note(data.get('notes'))
+    if note_error:
+        logger.warning("Invalid notes: %s", note_error)
+        return None, note_error, 400
+    notes = [new_note(current_user, data['notes'])] if data.get('notes') else []
+
+    return {
+        'doctor_id': doctor_id,
+        'user_id': current_user['_id'],
+        'date': appointment_date,
+        'time': appointment_time,
+        'reason': data.get('reason'),
+        'note_entries': notes,
+        'notes_count': len(notes),
+        'latest_note': notes[-1] if notes else None,
+        'status': 'pending',
+        'created_at': datetime.datetime.utcnow()
+    }, None, None
+
+def format_created_appointment(appointment_id, appointment):
+    return serializers.patient_appointment(appointment, id=str(appointment_id), **note_summary(appointment))
+
 @app.route('/appointments/<appointment_id>/status', methods=['PUT'])
 @token_required
 def update_appointment_status(current_user, appointment_id):
     try:
-        logger.info(f"Updating status for appointment ID: {appointment_id}")
+        logger.info("Updating status for appointment ID: %s", appointment_id)
         data = request.get_json()
         if not data or not data.get('status'):
             logger.warning("Missing status in update request")
             return jsonify({'error': 'Status is required'}), 400
-        valid_statuses = ['pending', 'accepted', 'declined', 'completed', 'cancelled']
-        if data.get('status') not in valid_statuses:
-            logger.warning(f"Invalid status: {data.get('status')}")
-            return jsonify({'error': f'Invalid status. Must be one of: {", ".join(valid_statuses)}'}), 400
-        appointment = appointments_collection.find_one({'_id': ObjectId(appointment_id)})
+        if data.get('status') not in VALID_STATUSES:
+            logger.warning("Invalid status: %s", data.get('status'))
+            return jsonify({'error': f'Invalid status. Must be one of: {", ".join(VALID_STATUSES)}'}), 400
+        note_error = validate_note(data.get('notes'))
+        if note_error:
+            logger.warning("Invalid notes: %s", note_error)
+            return jsonify({'error': note_error}), 400
+        appointment = storage.get_appointment(storage.parse_id(appointment_id))
         if not appointment:
-            logger.warning(f"Appointment not found: {appointment_id}")
+            logger.warning("Appointment not found: %s", appointment_id)
             return jsonify({'error': 'Appointment not found'}), 404
-        if current_user['role'] == 'doctor' and str(appointment['doctor_id']) != str(current_user['_id']):
-            logger.warning(f"Unauthorized doctor access for appointment ID: {appointment_id}")
-            return jsonify({'error': 'Unauthorized. Not your appointment'}), 403
-        elif current_user['role'] == 'user' and str(appointment['user_id']) != str(current_user['_id']):
-            logger.warning(f"Unauthorized patient access for appointment ID: {appointment_id}")
-            return jsonify({'error': 'Unauthorized. Not your appointment'}), 403
+        access_error = check_appointment_access(current_user, appointment)
+        if access_error:
+            logger.warning("Unauthorized %s access for appointment ID: %s", current_user['role'], appointment_id)
+            return jsonify({'error': access_error}), 403
         old_status = appointment['status']
-        update_data = {'status': data.get('status')}
-        if data.get('notes'):
-            notes = appointment.get('notes', '')
-            new_note = f"[{datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] {data.get('notes')}"
-            update_data['notes'] = f"{notes}\n{new_note}" if notes else new_note
-        appointments_collection.update_one(
-            {'_id': ObjectId(appointment_id)},
-            {'$set': update_data}
-        )
-        logger.info(f"Appointment ID: {appointment_id} status updated to {data.get('status')}")
+        note = new_note(current_user, data.get('notes')) if data.get('notes') else None
+        storage.update_appointment_status(appointment['_id'], data.get('status'), note)
+        appointments_changed('update', [appointment])
+        logger.info("Appointment ID: %s status updated to %s", appointment_id, data.get('status'))
         return jsonify({
             'message': f'Appointment status updated from {old_status} to {data.get("status")}',
             'status': data.get('status')
         }), 200
     except Exception as e:
-        logger.error(f"Error in update_appointment_status: {str(e)}")
+        logger.error("Error in update_appointment_status: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/appointments', methods=['POST'])
+@app.route('/appointments/status', methods=['PUT'])
 @token_required
-def create_appointment(current_user):
+def bulk_update_appointment_status(current_user):
     try:
-        logger.info(f"Creating appointment for user ID: {current_user['_id']}")
         data = request.get_json()
-        logger.debug(f"Received payload: {data}")
+        items = data.get('appointments') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            logger.warning("Missing appointments list in bulk status request")
+            return jsonify({'error': 'appointments must be a non-empty list'}), 400
+        if len(items) > MAX_BULK_SIZE:
+            return jsonify({'error': f'At most {MAX_BULK_SIZE} appointments per request'}), 400
+        logger.info("Bulk status update of %s appointments by user ID: %s", len(items), current_user['_id'])
 
-        # Validate required fields
-        required_fields = ['doctor_id', 'date', 'time', 'reason']
-        missing_fields = [field for field in required_fields if not data.get(field)]
-        if missing_fields:
-            logger.warning(f"Missing required fields: {missing_fields}")
-            return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
+        results = [None] * len(items)
+        object_ids = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or item.get('status') not in VALID_STATUSES:
+                results[index] = {'id': item.get('id') if isinstance(item, dict) else None, 'status': 400,
+                                  'error': f'Invalid status. Must be one of: {", ".join(VALID_STATUSES)}'}
+                continue
+            note_error = validate_note(item.get('notes'))
+            if note_error:
+                results[index] = {'id': item.get('id'), 'status': 400, 'error': note_error}
+                continue
+            if not isinstance(item.get('id'), str) or not ObjectId.is_valid(item['id']):
+                results[index] = {'id': item.get('id'), 'status': 400, 'error': 'Invalid appointment ID'}
+                continue
+            object_ids[index] = ObjectId(item['id'])
 
-        # Validate doctor_id
-        try:
-            doctor_id = ObjectId(data.get('doctor_id'))
-        except Exception:
-            logger.warning(f"Invalid doctor_id: {data.get('doctor_id')}")
-            return jsonify({'error': 'Doctor ID must be a valid ObjectId'}), 400
+        # Ownership for every id is checked against a single $in query
+        appointments = {
+            appointment['_id']: appointment
+            for appointment in appointments_collection.find(
+                {'_id': {'$in': list(object_ids.values())}},
+                {'doctor_id': 1, 'user_id': 1, 'status': 1}
+            )
+        }
+        operations = []
+        pending = []
+        for index, object_id in object_ids.items():
+            item = items[index]
+            appointment = appointments.get(object_id)
+            if not appointment:
+                results[index] = {'id': item.get('id'), 'status': 404, 'error': 'Appointment not found'}
+                continue
+            access_error = check_appointment_access(current_user, appointment)
+            if access_error:
+                results[index] = {'id': item.get('id'), 'status': 403, 'error': access_error}
+                continue
+            update = {'$set': {'status': item['status']}}
+            if item.get('notes'):
+                add_note(update, new_note(current_user, item['notes']))
+            operations.append(UpdateOne({'_id': object_id}, update))
+            pending.append((index, appointment['status']))
 
-        # Check if doctor exists and has correct role
-        doctor = users_collection.find_one({'_id': doctor_id, 'role': 'doctor'})
-        if not doctor:
-            logger.warning(f"Doctor not found or invalid role for ID: {doctor_id}")
-            return jsonify({'error': 'Doctor not found or invalid'}), 404
+        if operations:
+            appointments_collection.bulk_write(operations, ordered=False)
+            appointments_changed('update', [appointments[object_ids[index]] for index, _ in pending])
+        for index, old_status in pending:
+            results[index] = {'id': items[index].get('id'), 'status': 200,
+                              'message': f'Appointment status updated from {old_status} to {items[index]["status"]}'}
+        logger.info("Bulk status update applied to %s of %s appointments", len(operations), len(items))
+        return jsonify({'results': results}), 200
+    except Exception as e:
+        logger.error("Error in bulk_update_appointment_status: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
 
-        # Validate date and time
-        try:
-            appointment_date = datetime.datetime.strptime(data.get('date'), '%Y-%m-%d').strftime('%Y-%m-%d')
-            appointment_time = datetime.datetime.strptime(data.get('time'), '%H:%M').strftime('%H:%M')
-        except ValueError as e:
-            logger.warning(f"Invalid date or time format: {str(e)}")
-            return jsonify({'error': 'Invalid date or time format. Use YYYY-MM-DD for date and HH:MM for time'}), 400
-
-        # Validate reason length
-        if len(data.get('reason')) > 200:
-            logger.warning("Reason exceeds maximum length of 200 characters")
-            return jsonify({'error': 'Reason must not exceed 200 characters'}), 400
-
-        # Check for existing appointment
-        logger.debug(f"Checking for existing appointment: doctor_id={doctor_id}, date={appointment_date}, time={appointment_time}")
-        existing_appointment = appointments_collection.find_one({
-            'doctor_id': doctor_id,
-            'date': appointment_date,
-            'time': appointment_time
-        })
-        if existing_appointment:
-            logger.warning(f"Time slot already booked: {appointment_date} {appointment_time}")
-            return jsonify({'error': 'Time slot already booked'}), 409
+@app.route('/appointments', methods=['POST'])
+@token_required
+def create_appointment(current_user):
+    try:
+        logger.info("Creating appointment for user ID: %s", current_user['_id'])
+        data = request.get_json()
+
+        new_appointment, error, status_code = build_appointment(current_user, data)
+        if error:
+            return jsonify({'error': error}), status_code
 
-        # Create new appointment
         logger.debug("Creating new appointment")
-        new_appointment = {
-            'doctor_id': doctor_id,
-            'user_id': current_user['_id'],
-            'date': appointment_date,
-            'time': appointment_time,
-            'reason': data.get('reason'),
-            'notes': data.get('notes', ''),
-            'status': 'pending',
-            'created_at': datetime.datetime.utcnow()
-        }
-        result = appointments_collection.insert_one(new_appointment)
-        logger.info(f"Appointment created successfully: ID {result.inserted_id}")
+        try:
+            appointment_id = storage.create_appointment(new_appointment)
+        except SlotTaken:
+            logger.warning("Time slot already booked: %s %s", new_appointment['date'], new_appointment['time'])
+            return jsonify({'error': 'Time slot already booked'}), 409
+        new_appointment['_id'] = appointment_id
+        availability_index.mark(new_appointment['doctor_id'], new_appointment['date'], new_appointment['time'])
+        appointments_changed('insert', [new_appointment])
+        logger.info("Appointment created successfully: ID %s", appointment_id)
 
         return jsonify({
             'message': 'Appointment created successfully',
-            'appointment': {
-                'id': str(result.inserted_id),
-                'doctor_id': str(new_appointment['doctor_id']),
-                'date': new_appointment['date'],
-                'time': new_appointment['time'],
-                'reason': new_appointment['reason'],
-                'status': new_appointment['status'],
-                'notes': new_appointment['notes']
-            }
+            'appointment': format_created_appointment(appointment_id, new_appointment)
         }), 201
     except Exception as e:
-        logger.error(f"Error in create_appointment: {str(e)}")
+        logger.error("Error in create_appointment: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/appointments/bulk', methods=['POST'])
+@token_required
+def bulk_create_appointments(current_user):
+    try:
+        data = request.get_json()
+        items = data.get('appointments') if isinstance(data, dict) else None
+        if not items or not isinstance(items, list):
+            logger.warning("Missing appointments list in bulk create request")
+            return jsonify({'error': 'appointments must be a non-empty list'}), 400
+        if len(items) > MAX_BULK_SIZE:
+            return jsonify({'error': f'At most {MAX_BULK_SIZE} appointments per request'}), 400
+        logger.info("Bulk creating %s appointments for user ID: %s", len(items), current_user['_id'])
+
+        results = [None] * len(items)
+        operations = []
+        pending = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {'status': 400, 'error': 'Each appointment must be an object'}
+                continue
+            new_appointment, error, status_code = build_appointment(current_user, item)
+            if error:
+                results[index] = {'status': status_code, 'error': error}
+                continue
+            operations.append(InsertOne(new_appointment))
+            pending.append((index, new_appointment))
+
+        failed = {}
+        if operations:
+            embed_identities([new_appointment for _, new_appointment in pending])
+            try:
+                appointments_collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details.get('writeErrors', []):
+                    failed[write_error['index']] = write_error
+            appointments_changed('insert', [appointment for position, (_, appointment) in enumerate(pending) if position not in failed])
+        for position, (index, new_appointment) in enumerate(pending):
+            write_error = failed.get(position)
+            if write_error is None:
+                availability_index.mark(new_appointment['doctor_id'], new_appointment['date'], new_appointment['time'])
+                results[index] = {'status': 201,
+                                  'appointment': format_created_appointment(new_appointment['_id'], new_appointment)}
+            elif write_error.get('code') == 11000:
+                results[index] = {'status': 409, 'error': 'Time slot already booked'}
+            else:
+                logger.error("Bulk insert error for item %s: %s", index, write_error.get('errmsg'))
+                results[index] = {'status': 500, 'error': 'Internal server error'}
+        logger.info("Bulk created %s of %s appointments", len(pending) - len(failed), len(items))
+        return jsonify({'results': results}), 200
+    except Exception as e:
+        logger.error("Error in bulk_create_appointments: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/appointments/<appointment_id>/notes', methods=['GET'])
+@token_required
+@secondary_reads(user_scope)
+def get_appointment_notes(current_user, appointment_id):
+    try:
+        parsed_id = storage.parse_id(appointment_id)
+    except Exception:
+        logger.warning("Invalid appointment ID: %s", appointment_id)
+        return jsonify({'error': 'Invalid appointment ID'}), 400
+    try:
+        # Notes are paged oldest first; the cursor is the number of notes already returned
+        offset = int(request.args.get('after') or 0)
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        if offset < 0 or limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        logger.warning("Invalid notes pagination parameters")
+        return jsonify({'error': f'after must be a cursor from X-Next-Cursor and limit between 1 and {MAX_PAGE_SIZE}'}), 400
+    try:
+        appointment, notes, count = storage.list_appointment_notes(parsed_id, offset, limit)
+        if not appointment:
+            logger.warning("Appointment not found: %s", appointment_id)
+            return jsonify({'error': 'Appointment not found'}), 404
+        access_error = check_appointment_access(current_user, appointment)
+        if access_error:
+            logger.warning("Unauthorized %s notes access for appointment ID: %s", current_user['role'], appointment_id)
+            return jsonify({'error': access_error}), 403
+        next_cursor = str(offset + limit) if len(notes) > limit else None
+        response = jsonify({
+            'notes': [format_note(note) for note in notes[:limit]],
+            'count': count
+        })
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
+    except Exception as e:
+        logger.error("Error in get_appointment_notes: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/appointments/<appointment_id>', methods=['DELETE'])
 @token_required
 def delete_appointment(current_user, appointment_id):
     try:
-        logger.info(f"Deleting appointment ID: {appointment_id}")
-        appointment = appointments_collection.find_one({'_id': ObjectId(appointment_id)})
+        logger.info("Deleting appointment ID: %s", appointment_id)
+        appointment = storage.get_appointment(storage.parse_id(appointment_id))
         if not appointment:
-            logger.warning(f"Appointment not found: {appointment_id}")
+            logger.warning("Appointment not found: %s", appointment_id)
             return jsonify({'error': 'Appointment not found'}), 404
-        if current_user['role'] == 'doctor' and str(appointment['doctor_id']) != str(current_user['_id']):
-            logger.warning(f"Unauthorized doctor delete attempt for appointment ID: {appointment_id}")
-            return jsonify({'error': 'Unauthorized. Not your appointment'}), 403
-        elif current_user['role'] == 'user' and str(appointment['user_id']) != str(current_user['_id']):
-            logger.warning(f"Unauthorized patient delete attempt for appointment ID: {appointment_id}")
-            return jsonify({'error': 'Unauthorized. Not your appointment'}), 403
-        appointments_collection.delete_one({'_id': ObjectId(appointment_id)})
-        logger.info(f"Appointment ID: {appointment_id} deleted successfully")
+        access_error = check_appointment_access(current_user, appointment)
+        if access_error:
+            logger.warning("Unauthorized %s delete attempt for appointment ID: %s", current_user['role'], appointment_id)
+            return jsonify({'error': access_error}), 403
+        storage.delete_appointment(appointment['_id'])
+        availability_index.release(appointment['doctor_id'], appointment['date'])
+        appointments_changed('delete', [appointment])
+        logger.info("Appointment ID: %s deleted successfully", appointment_id)
         return jsonify({'message': 'Appointment deleted successfully'}), 200
     except Exception as e:
-        logger.error(f"Error in delete_appointment: {str(e)}")
+        logger.error("Error in delete_appointment: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
+def parse_change_cursor(value, default):
+    if value is None or value == '':
+        return default
+    try:
+        cursor = int(value)
+    except ValueError:
+        raise ValueError('since must be a cursor returned by /appointments/changes')
+    if cursor < 0:
+        raise ValueError('since must be a cursor returned by /appointments/changes')
+    return cursor
+
+def change_cursor_expired(since):
+    """True if entries after `since` may already have been dropped from the change log."""
+    if since > change_log.latest():
+        return True
+    oldest = change_log.oldest()
+    return oldest is not None and oldest > since + 1
+
+def load_changes(current_user, since, limit):
+    """Read one user's changes after `since`, rendered the way their listing renders them.
+
+    Returns (changes, cursor, has_more); several entries for the same appointment
+    collapse into its latest state, fetched with one $in query.
+    """
+    is_doctor = current_user['role'] == 'doctor'
+    owner_field = 'doctor_id' if is_doctor else 'user_id'
+    entries, cursor, has_more = change_log.read(owner_field, current_user['_id'], since, limit)
+    latest_ops = {}
+    for entry in entries:
+        latest_ops.pop(entry['appointment_id'], None)
+        latest_ops[entry['appointment_id']] = entry['op']
+    upserted = [appointment_id for appointment_id, op in latest_ops.items() if op != 'delete']
+    appointments = list(appointments_collection.find({'_id': {'$in': upserted}}, APPOINTMENT_LIST_FIELDS)) if upserted else []
+    if is_doctor:
+        patients, patient_profiles = resolve_identities(appointments, 'user_id', patient_profiles_collection)
+        formatted = format_doctor_appointments(appointments, patients, patient_profiles)
+    else:
+        doctors, doctor_profiles = resolve_identities(appointments, 'doctor_id', doctor_profiles_collection)
+        formatted = format_patient_appointments(appointments, doctors, doctor_profiles)
+    formatted = {row['id']: row for row in formatted}
+    changes = []
+    for appointment_id, op in latest_ops.items():
+        if op == 'delete':
+            changes.append({'op': 'delete', 'id': str(appointment_id)})
+        elif str(appointment_id) in formatted:
+            # Appointments deleted since the entry was read have a later delete entry
+            changes.append({'op': 'upsert', 'appointment': formatted[str(appointment_id)]})
+    return changes, cursor, has_more
+
+@app.route('/appointments/changes', methods=['GET'])
+@token_required
+def get_appointment_changes(current_user):
+    try:
+        since = parse_change_cursor(request.args.get('since'), None)
+        limit = parse_limit(default=MAX_PAGE_SIZE)
+    except ValueError as e:
+        logger.warning("Invalid change feed parameters: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        if since is None:
+            # Clients take a cursor before loading their listing, then only ask for deltas
+            return jsonify({'cursor': str(change_log.settled()), 'has_more': False, 'changes': []}), 200
+        if change_cursor_expired(since):
+            logger.info("Expired change cursor %s for user ID: %s", since, current_user['_id'])
+            return jsonify({'error': 'Cursor expired, reload the appointment list'}), 410
+        changes, cursor, has_more = load_changes(current_user, since, limit)
+        return jsonify({'cursor': str(cursor), 'has_more': has_more, 'changes': changes}), 200
+    except Exception as e:
+        logger.error("Error in get_appointment_changes: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/appointments/stream', methods=['GET'])
+@token_required
+def stream_appointment_changes(current_user):
+    try:
+        since = parse_change_cursor(request.headers.get('Last-Event-ID') or request.args.get('since'), None)
+    except ValueError as e:
+        logger.warning("Invalid change stream cursor: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        if since is None:
+            since = change_log.settled()
+        elif change_cursor_expired(since):
+            logger.info("Expired change cursor %s for user ID: %s", since, current_user['_id'])
+            return jsonify({'error': 'Cursor expired, reload the appointment list'}), 410
+    except Exception as e:
+        logger.error("Error in stream_appointment_changes: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+    poll_seconds = app.config['CHANGE_STREAM_POLL_SECONDS']
+    heartbeat_seconds = app.config['CHANGE_STREAM_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + app.config['CHANGE_STREAM_MAX_SECONDS']
+    logger.info("Opening change stream for user ID: %s at cursor %s", current_user['_id'], since)
+
+    def generate(cursor):
+        last_sent = time.monotonic()
+        yield f'retry: {int(poll_seconds * 1000)}\n\n'
+        while time.monotonic() < deadline:
+            try:
+                changes, cursor_after, has_more = load_changes(current_user, cursor, MAX_PAGE_SIZE)
+            except Exception as e:
+                logger.error("Error reading change stream for user ID %s: %s", current_user['_id'], e)
+                return
+            if changes:
+                data = json_provider.dumps({'cursor': str(cursor_after), 'changes': changes})
+                yield sse_event('changes', data, event_id=cursor_after)
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat_seconds:
+                # Comment lines keep proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            cursor = cursor_after
+            if not has_more:
+                time.sleep(poll_seconds)
+
+    return Response(generate(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/patient/profile', methods=['POST'])
 @token_required
 def add_patient_profile(current_user):
     try:
-        logger.info(f"Adding patient profile for user ID: {current_user['_id']}")
+        logger.info("Adding patient profile for user ID: %s", current_user['_id'])
         data = request.get_json()
-        existing_profile = patient_profiles_collection.find_one({'user_id': current_user['_id']})
+        existing_profile = storage.find_patient_profile(current_user['_id'], {'_id': 1})
         if existing_profile:
-            logger.warning(f"Profile already exists for user ID: {current_user['_id']}")
+            logger.warning("Profile already exists for user ID: %s", current_user['_id'])
             return jsonify({'error': 'Profile already exists for this patient'}), 400
         new_profile = {
             'user_id': current_user['_id'],
@@ -492,49 +2003,41 @@ def add_patient_profile(current_user):
             'age': data.get('age'),
             'medical_history': data.get('medical_history', '')
         }
-        result = patient_profiles_collection.insert_one(new_profile)
-        logger.info(f"Patient profile created for user ID: {current_user['_id']}")
+        profile_id = storage.create_patient_profile(new_profile)
+        mark_written(current_user['_id'])
+        fan_out_name('user_id', current_user['_id'], new_profile['name'])
+        logger.info("Patient profile created for user ID: %s", current_user['_id'])
         return jsonify({
             'message': 'Patient profile created successfully',
-            'profileId': str(result.inserted_id)
+            'profileId': str(profile_id)
         }), 201
     except Exception as e:
-        logger.error(f"Error in add_patient_profile: {str(e)}")
+        logger.error("Error in add_patient_profile: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/profile', methods=['GET'])
 @token_required
+@secondary_reads(user_scope)
 def get_user_profile(current_user):
     try:
-        logger.info(f"Fetching profile for user ID: {current_user['_id']}")
+        logger.info("Fetching profile for user ID: %s", current_user['_id'])
         result = {
             'id': str(current_user['_id']),
             'email': current_user['email'],
             'role': current_user['role']
         }
         if current_user['role'] == 'doctor':
-            profile = doctor_profiles_collection.find_one({'user_id': current_user['_id']})
+            profile = storage.find_doctor_profile(current_user['_id'], serializers.doctor_profile.projection)
             if profile:
-                result['profile'] = {
-                    'id': str(profile['_id']),
-                    'name': profile['name'],
-                    'specialty': profile.get('specialty', ''),
-                    'bio': profile.get('bio', ''),
-                    'experience': profile.get('experience', 0)
-                }
+                result['profile'] = serializers.doctor_profile(profile)
         else:
-            profile = patient_profiles_collection.find_one({'user_id': current_user['_id']})
+            profile = storage.find_patient_profile(current_user['_id'], serializers.patient_profile.projection)
             if profile:
-                result['profile'] = {
-                    'id': str(profile['_id']),
-                    'name': profile['name'],
-                    'age': profile.get('age'),
-                    'medical_history': profile.get('medical_history', '')
-                }
-        logger.info(f"Returning profile for user ID: {current_user['_id']}")
+                result['profile'] = serializers.patient_profile(profile)
+        logger.info("Returning profile for user ID: %s", current_user['_id'])
         return jsonify(result), 200
     except Exception as e:
-        logger.error(f"Error in get_user_profile: {str(e)}")
+        logger.error("Error in get_user_profile: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/', methods=['GET'])
@@ -0,0 +1,368 @@
+"""ASGI entry point for PhysioConnect.
+
+The read-heavy dashboard routes are served natively with Motor, running
+independent lookups concurrently; every other route falls through to the
+Flask app in app.py, so both entry points expose the same JSON contract.
+
+    uvicorn asgi:app --workers 2
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from functools import wraps
+
+import jwt
+from asgiref.wsgi import WsgiToAsgi
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_accept_header
+
+import app as flask_module
+from cache import MongoBackend
+import serializers
+from compression import COMPRESSIBLE_MIMETYPES, available_encodings, compress
+from config import mongo_client_options
+from mongo import Mongo, read_preference_var
+
+logger = logging.getLogger(__name__)
+
+config = flask_module.app.config
+# Created on the first query, inside the worker's event loop
+mongo = Mongo(config['MONGO_URI'], config['MONGO_DB_NAME'], client_class=AsyncIOMotorClient,
+              **mongo_client_options(config))
+users_collection = mongo['users']
+doctor_profiles_collection = mongo['doctor_profiles']
+appointments_collection = mongo['appointments']
+patient_profiles_collection = mongo['patient_profiles']
+write_markers_collection = mongo['write_markers']
+
+
+def json_response(data, status=200, headers=None):
+    # Matches Flask's jsonify output byte for byte (same encoder, so the same JSON provider)
+    # so cached bodies and ETags are shared
+    body = json.dumps(data, cls=flask_module.app.json_encoder, sort_keys=config['JSON_SORT_KEYS'],
+                      separators=(',', ':'), ensure_ascii=config['JSON_AS_ASCII']) + '\n'
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+async def load_user(user_id):
+    user = flask_module.user_cache.get(user_id)
+    if user is None:
+        user = await users_collection.find_one({'_id': ObjectId(user_id)}, {'password': 0})
+        if user:
+            flask_module.user_cache.set(user_id, user)
+    return user
+
+
+def check_rate_limit(route, client):
+    """Charge a request to the Flask app's limiter, so both entry points share buckets and limits."""
+    if not config['RATE_LIMIT_ENABLED'] or route in config['RATE_LIMIT_EXEMPT']:
+        return None
+    return flask_module.rate_limiter.hit(route, client)
+
+
+def too_many_requests(route, client, result):
+    logger.warning("Rate limit exceeded on %s by %s", route, client)
+    return json_response({'error': 'Too many requests, please retry shortly'}, 429, headers=result.headers())
+
+
+def with_rate_limit_headers(response, result):
+    if result is not None:
+        response.headers.update(result.headers())
+    return response
+
+
+def ip_rate_limited(f):
+    @wraps(f)
+    async def decorated(request):
+        client = f'ip:{request.client.host if request.client else None}'
+        result = check_rate_limit(f.__name__, client)
+        if result is not None and not result.allowed:
+            return too_many_requests(f.__name__, client, result)
+        return with_rate_limit_headers(await f(request), result)
+    return decorated
+
+
+def token_required(f):
+    @wraps(f)
+    async def decorated(request):
+        token = request.headers.get('Authorization')
+        if not token:
+            logger.warning("Token missing in request")
+            return json_response({'error': 'Token is missing'}, 401)
+        try:
+            if token.startswith('Bearer '):
+                token = token.split(" ")[1]
+            data = jwt.decode(token, config['SECRET_KEY'], algorithms=["HS256"])
+            client = f"user:{data['user_id']}"
+            result = check_rate_limit(f.__name__, client)
+            if result is not None and not result.allowed:
+                return too_many_requests(f.__name__, client, result)
+            current_user = await load_user(data['user_id'])
+            if not current_user:
+                logger.warning("User not found for ID: %s", data['user_id'])
+                return json_response({'error': 'User not found'}, 401)
+        except jwt.ExpiredSignatureError:
+            logger.warning("Token expired")
+            return json_response({'error': 'Token has expired'}, 401)
+        except jwt.InvalidTokenError:
+            logger.warning("Invalid token")
+            return json_response({'error': 'Invalid token'}, 401)
+        except Exception as e:
+            logger.error("Token error: %s", e)
+            return json_response({'error': f'Token error: {str(e)}'}, 401)
+        return with_rate_limit_headers(await f(request, current_user), result)
+    return decorated
+
+
+def role_required(role):
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request, current_user):
+            if current_user['role'] != role:
+                logger.warning("Access denied for user ID %s. Required role: %s", current_user['_id'], role)
+                return json_response({'error': f'Access denied. {role} role required'}, 403)
+            return await f(request, current_user)
+        return decorated_function
+    return decorator
+
+
+def cached_response(namespace):
+    """Async counterpart of app.cached_response, sharing its cache entries and ETags."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated(request):
+            cache_namespace = namespace(**request.path_params) if callable(namespace) else namespace
+            key = f"{request.url.path}?{request.url.query}"
+            slot, entry = flask_module.response_cache.lookup(cache_namespace, key)
+            if entry is None:
+                response = await f(request)
+                if response.status_code != 200:
+                    return response
+                entry = {
+                    'body': response.body,
+                    'etag': hashlib.sha256(response.body).hexdigest(),
+                    'mimetype': response.media_type,
+                    'headers': {header: response.headers[header] for header in flask_module.CACHED_HEADERS if header in response.headers}
+                }
+                flask_module.response_cache.set(slot, entry)
+            request.state.response_cache_entry = entry
+            headers = dict(entry['headers'], ETag=f'"{entry["etag"]}"')
+            headers['Cache-Control'] = 'no-cache'
+            if f'"{entry["etag"]}"' in request.headers.get('If-None-Match', ''):
+                return Response(status_code=304, headers=headers)
+            return Response(entry['body'], headers=headers, media_type=entry['mimetype'])
+        return decorated
+    return decorator
+
+
+def compressed(f):
+    """Async counterpart of app.compress_response for the routes served here."""
+    @wraps(f)
+    async def decorated(request):
+        response = await f(request)
+        if (not config['COMPRESSION_ENABLED'] or response.status_code != 200
+                or 'content-encoding' in response.headers or response.media_type not in COMPRESSIBLE_MIMETYPES
+                or len(response.body) < config['COMPRESSION_MIN_BYTES']):
+            return response
+        response.headers.add_vary_header('Accept-Encoding')
+        encoding = parse_accept_header(request.headers.get('Accept-Encoding')).best_match(available_encodings())
+        if encoding is None:
+            return response
+        entry = getattr(request.state, 'response_cache_entry', None)
+        encoded = entry.setdefault('encoded', {}) if entry is not None else {}
+        if encoding not in encoded:
+            encoded[encoding] = compress(response.body, encoding, config['COMPRESSION_LEVEL'], config['BROTLI_QUALITY'])
+        response.body = encoded[encoding]
+        response.headers['Content-Length'] = str(len(response.body))
+        response.headers['Content-Encoding'] = encoding
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+    return decorated
+
+
+async def read_preference_for(scopes):
+    """Async app.read_preference_for; markers shared through MongoDB are read with Motor."""
+    write_markers = flask_module.write_markers
+    if not isinstance(write_markers, MongoBackend):
+        return flask_module.read_preference_for(scopes)
+    if not flask_module.secondary_reads_enabled():
+        return None
+    marked = await write_markers_collection.find_one(write_markers.live_filter(str(scope) for scope in scopes), {'_id': 1})
+    return None if marked else flask_module.secondary_read_preference
+
+
+def secondary_reads(scopes):
+    """Async app.secondary_reads; scopes receives the path params and current_user, if any."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated(request, *args):
+            scope_names = scopes(*args, **request.path_params)
+            token = read_preference_var.set(await read_preference_for(scope_names))
+            try:
+                return await f(request, *args)
+            finally:
+                read_preference_var.reset(token)
+        return decorated
+    return decorator
+
+
+async def resolve_identities(appointments, key, profiles_collection):
+    """Async app.resolve_identities: the users and profiles $in queries run concurrently."""
+    ids = flask_module.identity_ids(appointments, key)
+    if not ids:
+        return {}, {}
+    users, profiles = await asyncio.gather(
+        users_collection.find({'_id': {'$in': ids}}, {'email': 1, 'role': 1}).to_list(None),
+        profiles_collection.find({'user_id': {'$in': ids}}, {'user_id': 1, 'name': 1}).to_list(None)
+    )
+    return {user['_id']: user for user in users}, {profile['user_id']: profile for profile in profiles}
+
+
+async def paginate_appointments(request, base_query):
+    query, limit = flask_module.appointments_query(base_query, request.query_params)
+    appointments = await appointments_collection.find(query, flask_module.APPOINTMENT_LIST_FIELDS).sort('_id', 1).limit(limit + 1).to_list(None)
+    return flask_module.split_page(appointments, limit)
+
+
+def page_headers(next_cursor):
+    return {'X-Next-Cursor': next_cursor} if next_cursor else None
+
+
+@compressed
+@ip_rate_limited
+@cached_response('doctors')
+@secondary_reads(lambda: ['doctors'])
+async def get_doctors(request):
+    try:
+        pipeline, limit = flask_module.doctors_pipeline(request.query_params)
+    except ValueError as e:
+        logger.warning("Invalid doctor listing parameters: %s", e)
+        return json_response({'error': str(e)}, 400)
+    try:
+        profiles = await doctor_profiles_collection.aggregate(pipeline).to_list(None)
+        profiles, next_cursor = flask_module.split_page(profiles, limit, key='user_id')
+        doctors = flask_module.format_doctors(profiles)
+        logger.info("Returning %s doctors", len(doctors))
+        return json_response(doctors, headers=page_headers(next_cursor))
+    except Exception as e:
+        logger.error("Get doctors error: %s", e)
+        return json_response({'error': 'Internal server error'}, 500)
+
+
+@compressed
+@ip_rate_limited
+@cached_response(lambda id: f'doctor:{id}')
+@secondary_reads(lambda id: [f'doctor:{id}'])
+async def get_doctor_profile(request):
+    id = request.path_params['id']
+    try:
+        logger.info("Fetching doctor profile for ID: %s", id)
+        profile, doctor = await asyncio.gather(
+            doctor_profiles_collection.find_one({'user_id': ObjectId(id)}, serializers.doctor_detail.projection),
+            users_collection.find_one({'_id': ObjectId(id), 'role': 'doctor'}, {'email': 1})
+        )
+        if not profile:
+            logger.warning("Profile not found for user ID: %s", id)
+            return json_response({'error': 'Profile not found'}, 404)
+        if not doctor:
+            logger.warning("Invalid doctor profile for user ID: %s", id)
+            return json_response({'error': 'Invalid doctor profile'}, 400)
+        return json_response(serializers.doctor_detail(profile, email=doctor['email']))
+    except Exception as e:
+        logger.error("Get doctor profile error: %s", e)
+        return json_response({'error': 'Internal server error'}, 500)
+
+
+@compressed
+@token_required
+@role_required('doctor')
+@secondary_reads(flask_module.user_scope)
+async def get_doctor_appointments(request, current_user):
+    try:
+        appointments, next_cursor = await paginate_appointments(request, {'doctor_id': current_user['_id']})
+    except ValueError as e:
+        logger.warning("Invalid appointment query parameters: %s", e)
+        return json_response({'error': str(e)}, 400)
+    try:
+        patients, patient_profiles = await resolve_identities(appointments, 'user_id', patient_profiles_collection)
+        formatted_appointments = flask_module.format_doctor_appointments(appointments, patients, patient_profiles)
+        logger.info("Returning %s formatted appointments", len(formatted_appointments))
+        return json_response(formatted_appointments, headers=page_headers(next_cursor))
+    except Exception as e:
+        logger.error("Critical error in get_doctor_appointments: %s", e)
+        return json_response({'error': f'Internal server error: {str(e)}'}, 500)
+
+
+@compressed
+@token_required
+@secondary_reads(flask_module.user_scope)
+async def get_patient_appointments(request, current_user):
+    try:
+        appointments, next_cursor = await paginate_appointments(request, {'user_id': current_user['_id']})
+    except ValueError as e:
+        logger.warning("Invalid appointment query parameters: %s", e)
+        return json_response({'error': str(e)}, 400)
+    try:
+        doctors, doctor_profiles = await resolve_identities(appointments, 'doctor_id', doctor_profiles_collection)
+        formatted_appointments = flask_module.format_patient_appointments(appointments, doctors, doctor_profiles)
+        logger.info("Returning %s patient appointments", len(formatted_appointments))
+        return json_response(formatted_appointments, headers=page_headers(next_cursor))
+    except Exception as e:
+        logger.error("Error in get_patient_appointments: %s", e)
+        return json_response({'error': 'Internal server error'}, 500)
+
+
+@compressed
+@token_required
+@secondary_reads(flask_module.user_scope)
+async def get_user_profile(request, current_user):
+    try:
+        result = {
+            'id': str(current_user['_id']),
+            'email': current_user['email'],
+            'role': current_user['role']
+        }
+        if current_user['role'] == 'doctor':
+            profile = await doctor_profiles_collection.find_one({'user_id': current_user['_id']},
+                                                                serializers.doctor_profile.projection)
+            if profile:
+                result['profile'] = serializers.doctor_profile(profile)
+        else:
+            profile = await patient_profiles_collection.find_one({'user_id': current_user['_id']},
+                                                                 serializers.patient_profile.projection)
+            if profile:
+                result['profile'] = serializers.patient_profile(profile)
+        return json_response(result)
+    except Exception as e:
+        logger.error("Error in get_user_profile: %s", e)
+        return json_response({'error': 'Internal server error'}, 500)
+
+
+routes = [
+    Route('/doctors', get_doctors, methods=['GET']),
+    Route('/doctor/appointments', get_doctor_appointments, methods=['GET']),
+    Route('/doctor/{id}', get_doctor_profile, methods=['GET']),
+    Route('/patient/appointments', get_patient_appointments, methods=['GET']),
+    Route('/profile', get_user_profile, methods=['GET']),
+] if flask_module.storage.supports_mongo_features else []
+# Writes and the remaining routes (all of them with STORAGE_BACKEND=sql) are served by the synchronous Flask app
+routes.append(Mount('/', app=WsgiToAsgi(flask_module.app)))
+
+app = Starlette(routes=routes, middleware=[
+    Middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173", "http://localhost:5000"],
+        allow_methods=['*'],
+        allow_headers=['*'],
+        expose_headers=['X-Next-Cursor', 'Retry-After', 'RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'RateLimit-Policy'],
+    )
+])
@@ -0,0 +1,114 @@
+import datetime
+import threading
+from cache import TTLCache
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DEFAULT_WORKING_HOURS = {day: [['09:00', '17:00']] for day in WEEKDAYS[:5]}
+DEFAULT_SLOT_MINUTES = 30
+MAX_RANGE_DAYS = 31
+
+
+def to_minutes(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def validate_schedule(working_hours, slot_minutes):
+    """Return an error message if the working hours or slot length are malformed, else None."""
+    if slot_minutes is not None:
+        if not isinstance(slot_minutes, int) or isinstance(slot_minutes, bool) or not 5 <= slot_minutes <= 240:
+            return 'slot_minutes must be an integer between 5 and 240'
+    if working_hours is not None:
+        if not isinstance(working_hours, dict):
+            return 'working_hours must be an object keyed by weekday'
+        for day, windows in working_hours.items():
+            if day not in WEEKDAYS:
+                return f'Invalid weekday in working_hours: {day}. Use one of: {", ".join(WEEKDAYS)}'
+            if not isinstance(windows, list):
+                return f'working_hours.{day} must be a list of [start, end] pairs'
+            for window in windows:
+                try:
+                    start, end = window
+                    datetime.datetime.strptime(start, '%H:%M')
+                    datetime.datetime.strptime(end, '%H:%M')
+                except (TypeError, ValueError):
+                    return f'Invalid window in working_hours.{day}. Use ["HH:MM", "HH:MM"]'
+                if to_minutes(start) >= to_minutes(end):
+                    return f'Window start must be before end in working_hours.{day}'
+    return None
+
+
+class AvailabilityIndex:
+    """Per-doctor, per-day bitmaps of booked minutes, filled from one range query and kept current on writes.
+
+    Bit n of a day's bitmap is set when minute n of that day falls inside a booked slot.
+    Each worker keeps its own index, so entries expire after `ttl` seconds to pick up
+    bookings made elsewhere; the unique slot index remains the authority on conflicts.
+    """
+
+    def __init__(self, maxsize=5000, ttl=60):
+        self._doctors = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _entry(self, doctor_id, slot_minutes):
+        entry = self._doctors.get(doctor_id)
+        if entry is None or entry['slot_minutes'] != slot_minutes:
+            entry = {'slot_minutes': slot_minutes, 'days': {}}
+            self._doctors.set(doctor_id, entry)
+        return entry
+
+    def booked(self, load_slots, doctor_id, slot_minutes, dates):
+        """Return {date: bitmap} for `dates`, querying only the days not already indexed.
+
+        load_slots(doctor_id, first, last) returns the doctor's appointments between
+        two dates, each with its date and time (Storage.booked_slots).
+        """
+        key = str(doctor_id)
+        with self._lock:
+            entry = self._entry(key, slot_minutes)
+            missing = [date for date in dates if date not in entry['days']]
+        if missing:
+            days = {date: 0 for date in missing}
+            for appointment in load_slots(doctor_id, missing[0], missing[-1]):
+                if appointment['date'] in days:
+                    days[appointment['date']] |= self._slot_mask(appointment['time'], slot_minutes)
+            with self._lock:
+                entry['days'].update(days)
+        return {date: entry['days'][date] for date in dates}
+
+    def mark(self, doctor_id, date, time):
+        """Record a new booking in an already indexed day."""
+        with self._lock:
+            entry = self._doctors.get(str(doctor_id))
+            if entry is not None and date in entry['days']:
+                entry['days'][date] |= self._slot_mask(time, entry['slot_minutes'])
+
+    def release(self, doctor_id, date):
+        """Forget a day after a booking is removed; overlapping slots make clearing bits unsafe."""
+        with self._lock:
+            entry = self._doctors.get(str(doctor_id))
+            if entry is not None:
+                entry['days'].pop(date, None)
+
+    def invalidate(self, doctor_id):
+        self._doctors.invalidate(str(doctor_id))
+
+    @staticmethod
+    def _slot_mask(time, slot_minutes):
+        return ((1 << slot_minutes) - 1) << to_minutes(time)
+
+
+def free_slots(working_hours, slot_minutes, booked, now=None):
+    """Yield (date, [HH:MM, ...]) for each date in `booked` using the doctor's weekly hours."""
+    now = now or datetime.datetime.utcnow()
+    for date, bitmap in booked.items():
+        day = datetime.datetime.strptime(date, '%Y-%m-%d')
+        slots = []
+        for start, end in working_hours.get(WEEKDAYS[day.weekday()], []):
+            minute, end_minute = to_minutes(start), to_minutes(end)
+            while minute + slot_minutes <= end_minute:
+                mask = ((1 << slot_minutes) - 1) << minute
+                if not bitmap & mask and day + datetime.timedelta(minutes=minute) > now:
+                    slots.append(f'{minute // 60:02d}:{minute % 60:02d}')
+                minute += slot_minutes
+        yield date, slots
@@ -0,0 +1,480 @@
+"""Load-test and latency benchmark for the PhysioConnect API.
+
+Seeds a local stand-in database and drives the hot endpoints, reporting
+p50/p95/p99 latency, throughput and database queries per request as JSON.
+
+    # In-process against mongomock (no MongoDB needed)
+    python benchmark.py --doctors 2000 --patients 5000 --appointments 50000 -o bench.json
+
+    # In-process against a local mongod, in the physioconnect_bench database (--mongo-db)
+    python benchmark.py --mongo-uri mongodb://localhost:27017 -o bench.json
+
+    # Over HTTP against a running server that uses the same --mongo-uri and MONGO_DB_NAME
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --url http://localhost:5000
+
+    # A database that already holds data is only replaced with --reset
+    python benchmark.py --mongo-uri mongodb://localhost:27017 --reset
+
+    # Compare with an earlier run; exits 1 if any p95 regressed by more than --threshold
+    python benchmark.py -o new.json --baseline old.json
+
+    # The SQL storage backend on a scratch SQLite file (or --database-url), to compare with MongoDB
+    python benchmark.py --storage sql -o sql.json --baseline mongo.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from indexes import ensure_indexes
+
+SPECIALTIES = ['sports', 'orthopedic', 'neurological', 'pediatric', 'geriatric', 'cardiopulmonary']
+PASSWORD = 'benchmark-password'
+SCENARIOS = ['signin', 'doctors', 'doctor_appointments', 'patient_appointments', 'create_appointment']
+# Never the application's own database: seeding empties every collection below
+BENCH_DB_NAME = 'physioconnect_bench'
+SEEDED_COLLECTIONS = ('users', 'doctor_profiles', 'patient_profiles', 'appointments',
+                      'appointment_changes', 'counters', 'write_markers')
+
+_counter = threading.local()
+
+
+def count_query():
+    _counter.queries = getattr(_counter, 'queries', 0) + 1
+
+
+def install_query_counter(use_mongomock):
+    """Count MongoDB operations issued by the current thread."""
+    if use_mongomock:
+        import mongomock
+        for name in ('find', 'find_one', 'aggregate', 'insert_one', 'insert_many', 'update_one',
+                     'update_many', 'delete_one', 'delete_many', 'bulk_write', 'count_documents'):
+            original = getattr(mongomock.Collection, name)
+
+            def counted(self, *args, _original=original, **kwargs):
+                # mongomock implements some operations on top of others; count only the outermost call
+                depth = getattr(_counter, 'depth', 0)
+                if not depth:
+                    count_query()
+                _counter.depth = depth + 1
+                try:
+                    return _original(self, *args, **kwargs)
+                finally:
+                    _counter.depth = depth
+            setattr(mongomock.Collection, name, counted)
+    else:
+        from pymongo import monitoring
+
+        class QueryCounter(monitoring.CommandListener):
+            def started(self, event):
+                if event.command_name not in ('getMore', 'endSessions', 'hello', 'isMaster', 'ping'):
+                    count_query()
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+        monitoring.register(QueryCounter())
+
+
+def install_sql_query_counter():
+    """Count SQL statements issued by the current thread."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    event.listen(Engine, 'before_cursor_execute', lambda *args, **kwargs: count_query())
+
+
+def load_app(mongo_uri, database_url=None, mongo_db=BENCH_DB_NAME):
+    """Import app.py against the stand-in database; returns (app module, uses mongomock).
+
+    With database_url the app runs on the SQL storage backend instead of MongoDB.
+    """
+    # Every simulated client shares one IP and a handful of users; measure the app, not the limiter
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    os.environ['MONGO_DB_NAME'] = mongo_db
+    if database_url:
+        os.environ['STORAGE_BACKEND'] = 'sql'
+        os.environ['DATABASE_URL'] = database_url
+        install_sql_query_counter()
+        import app as app_module
+        return app_module, False
+    if mongo_uri:
+        os.environ['MONGO_URI'] = mongo_uri
+        install_query_counter(use_mongomock=False)
+        import app as app_module
+        return app_module, False
+    import mongomock
+    os.environ['MONGO_URI'] = 'mongodb://localhost:27017'
+    install_query_counter(use_mongomock=True)
+    with mongomock.patch(servers=(('localhost', 27017),)):
+        import app as app_module
+        # The client is created lazily; bind it to mongomock while the patch is active
+        app_module.mongo.client
+    return app_module, True
+
+
+def populated_collections(db):
+    """Names of the collections seed() would empty that already hold documents."""
+    return [name for name in SEEDED_COLLECTIONS if db[name].find_one({}, {'_id': 1}) is not None]
+
+
+def populated_tables(db):
+    """Names of the tables seed_sql() would drop that already hold rows."""
+    from sqlalchemy import inspect, select
+    existing = set(inspect(db.engine).get_table_names())
+    return [table.name for table in db.metadata.sorted_tables
+            if table.name in existing and db.session.execute(select(table).limit(1)).first() is not None]
+
+
+def seed(db, doctors, patients, appointments, rng):
+    """Replace the benchmark collections with generated data; returns doctor and patient ids."""
+    # The change log, its sequence counter and read-your-writes markers are cleared too,
+    # so every run starts from the same state
+    for name in SEEDED_COLLECTIONS:
+        db[name].delete_many({})
+    # Hashing once keeps seeding fast; signin still pays the full verification cost
+    password = generate_password_hash(PASSWORD)
+    now = datetime.datetime.utcnow()
+    doctor_users = [{'email': f'doctor{i}@bench.local', 'password': password, 'role': 'doctor', 'created_at': now}
+                    for i in range(doctors)]
+    patient_users = [{'email': f'patient{i}@bench.local', 'password': password, 'role': 'user', 'created_at': now}
+                     for i in range(patients)]
+    doctor_ids = db['users'].insert_many(doctor_users).inserted_ids
+    patient_ids = db['users'].insert_many(patient_users).inserted_ids
+    db['doctor_profiles'].insert_many([{
+        'user_id': doctor_id,
+        'name': f'Doctor {i}',
+        'specialty': rng.choice(SPECIALTIES),
+        'bio': f'Physiotherapist number {i}',
+        'experience': rng.randint(0, 30)
+    } for i, doctor_id in enumerate(doctor_ids)])
+    db['patient_profiles'].insert_many([{
+        'user_id': patient_id,
+        'name': f'Patient {i}',
+        'age': rng.randint(18, 90),
+        'medical_history': ''
+    } for i, patient_id in enumerate(patient_ids)])
+    batch = []
+    for appointment in generate_appointments(doctor_ids, patient_ids, appointments, rng):
+        batch.append(dict(appointment, note_entries=[], notes_count=0, latest_note=None, created_at=now))
+        if len(batch) == 10000:
+            db['appointments'].insert_many(batch)
+            batch = []
+    if batch:
+        db['appointments'].insert_many(batch)
+    return [str(i) for i in doctor_ids], [str(i) for i in patient_ids]
+
+
+def generate_appointments(doctor_ids, patient_ids, count, rng):
+    """Yield `count` appointments in distinct (doctor_id, date, time) slots during 2025."""
+    slots = set()
+    start = datetime.date(2025, 1, 1)
+    while len(slots) < count:
+        doctor_id = rng.choice(doctor_ids)
+        date = (start + datetime.timedelta(days=rng.randrange(365))).strftime('%Y-%m-%d')
+        minute = 8 * 60 + 30 * rng.randrange(20)
+        time_of_day = f'{minute // 60:02d}:{minute % 60:02d}'
+        if (doctor_id, date, time_of_day) in slots:
+            continue
+        slots.add((doctor_id, date, time_of_day))
+        yield {
+            'doctor_id': doctor_id,
+            'user_id': rng.choice(patient_ids),
+            'date': date,
+            'time': time_of_day,
+            'reason': 'Benchmark visit',
+            'status': rng.choice(['pending', 'accepted', 'completed'])
+        }
+
+
+def seed_sql(db, doctors, patients, appointments, rng):
+    """Recreate the SQL schema and fill it with the same shape of data as seed()."""
+    from sqlalchemy import insert
+    from models import Appointment, Doctor, PatientProfile, Profile, User
+    db.drop_all()
+    db.create_all()
+    password = generate_password_hash(PASSWORD)
+    now = datetime.datetime.utcnow()
+    # Ids are assigned here so rows can reference each other without reading them back;
+    # each doctor row shares its user's id
+    doctor_ids = list(range(1, doctors + 1))
+    patient_ids = list(range(doctors + 1, doctors + patients + 1))
+    db.session.execute(insert(User), [
+        {'id': user_id, 'email': f'doctor{i}@bench.local', 'password': password, 'role': 'doctor', 'created_at': now}
+        for i, user_id in enumerate(doctor_ids)
+    ] + [
+        {'id': user_id, 'email': f'patient{i}@bench.local', 'password': password, 'role': 'user', 'created_at': now}
+        for i, user_id in enumerate(patient_ids)
+    ])
+    db.session.execute(insert(Doctor), [{'id': doctor_id, 'user_id': doctor_id} for doctor_id in doctor_ids])
+    db.session.execute(insert(Profile), [{
+        'doctor_id': doctor_id,
+        'name': f'Doctor {i}',
+        'specialty': rng.choice(SPECIALTIES),
+        'bio': f'Physiotherapist number {i}',
+        'experience': rng.randint(0, 30)
+    } for i, doctor_id in enumerate(doctor_ids)])
+    db.session.execute(insert(PatientProfile), [{
+        'user_id': patient_id,
+        'name': f'Patient {i}',
+        'age': rng.randint(18, 90),
+        'medical_history': ''
+    } for i, patient_id in enumerate(patient_ids)])
+    db.session.execute(insert(Appointment), [
+        dict(appointment, created_at=now)
+        for appointment in generate_appointments(doctor_ids, patient_ids, appointments, rng)
+    ])
+    db.session.commit()
+    return [str(i) for i in doctor_ids], [str(i) for i in patient_ids]
+
+
+class TestClientDriver:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpDriver:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, token=None, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if token:
+            request.add_header('Authorization', f'Bearer {token}')
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+def signin(driver, email):
+    status, body = driver.request('POST', '/signin', body={'email': email, 'password': PASSWORD})
+    if status != 200:
+        raise RuntimeError(f'Signin failed for {email}: {status}')
+    return body['access_token']
+
+
+def build_scenarios(driver, doctor_ids, patient_ids, rng, sessions):
+    """Return {scenario: callable} where each callable issues one request and returns its status."""
+    doctor_tokens = [signin(driver, f'doctor{i}@bench.local')
+                     for i in rng.sample(range(len(doctor_ids)), min(sessions, len(doctor_ids)))]
+    patient_tokens = [signin(driver, f'patient{i}@bench.local')
+                      for i in rng.sample(range(len(patient_ids)), min(sessions, len(patient_ids)))]
+    booking = iter(range(10 ** 9))
+    booking_lock = threading.Lock()
+
+    def next_slot():
+        with booking_lock:
+            n = next(booking)
+        # Future dates keep new bookings clear of the seeded history
+        date = datetime.date(2030, 1, 1) + datetime.timedelta(days=n // (20 * len(doctor_ids)))
+        minute = 8 * 60 + 30 * (n // len(doctor_ids) % 20)
+        return doctor_ids[n % len(doctor_ids)], date.strftime('%Y-%m-%d'), f'{minute // 60:02d}:{minute % 60:02d}'
+
+    def do_signin():
+        return driver.request('POST', '/signin', body={
+            'email': f'patient{rng.randrange(len(patient_ids))}@bench.local', 'password': PASSWORD})[0]
+
+    def do_doctors():
+        specialty = rng.choice(SPECIALTIES + [None, None])
+        return driver.request('GET', f'/doctors?specialty={specialty}' if specialty else '/doctors')[0]
+
+    def do_doctor_appointments():
+        return driver.request('GET', '/doctor/appointments', token=rng.choice(doctor_tokens))[0]
+
+    def do_patient_appointments():
+        return driver.request('GET', '/patient/appointments', token=rng.choice(patient_tokens))[0]
+
+    def do_create_appointment():
+        doctor_id, date, time_of_day = next_slot()
+        return driver.request('POST', '/appointments', token=rng.choice(patient_tokens), body={
+            'doctor_id': doctor_id, 'date': date, 'time': time_of_day, 'reason': 'Benchmark booking'})[0]
+
+    return {
+        'signin': do_signin,
+        'doctors': do_doctors,
+        'doctor_appointments': do_doctor_appointments,
+        'patient_appointments': do_patient_appointments,
+        'create_appointment': do_create_appointment,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(action, requests, concurrency, count_queries):
+    def one(_):
+        _counter.queries = 0
+        started = time.perf_counter()
+        status = action()
+        elapsed = time.perf_counter() - started
+        return elapsed, status, _counter.queries
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'status_counts': statuses,
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(requests / wall, 1),
+        'queries_per_request': round(statistics.fmean(sample[2] for sample in samples), 2) if count_queries else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Print per-scenario p95 deltas against a baseline report; returns True if any regressed."""
+    regressed = False
+    for name, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous.get('p95_ms'):
+            continue
+        change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms']
+        flag = 'REGRESSION' if change > threshold else ''
+        regressed = regressed or bool(flag)
+        print(f"{name:22s} p95 {previous['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms ({change:+.1%}) "
+              f"queries {previous.get('queries_per_request')} -> {result.get('queries_per_request')} {flag}",
+              file=sys.stderr)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', help='Seed and run against this MongoDB instead of mongomock')
+    parser.add_argument('--mongo-db', default=BENCH_DB_NAME, help='Database to seed on --mongo-uri')
+    parser.add_argument('--reset', action='store_true',
+                        help='Replace the contents of a database that already holds data')
+    parser.add_argument('--storage', choices=['mongo', 'sql'], default='mongo', help='Storage backend to benchmark')
+    parser.add_argument('--database-url', help='SQLAlchemy URL for --storage sql; defaults to a scratch SQLite file')
+    parser.add_argument('--url', help='Drive a running server over HTTP instead of the Flask test client')
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--appointments', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--signin-requests', type=int, default=20, help='Requests for the CPU-bound signin scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=20, help='Distinct signed-in doctors and patients')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING', help='Application log level during the run')
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Allowed relative p95 increase')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    database_url = None
+    if args.storage == 'sql':
+        database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'physioconnect-bench.db')
+    app_module, uses_mongomock = load_app(args.mongo_uri, database_url, args.mongo_db)
+    logging.getLogger().setLevel(args.log_level)
+    if not args.reset:
+        # The default scratch SQLite file is the benchmark's own; anything else may be real data
+        if database_url and args.database_url:
+            with app_module.app.app_context():
+                populated = populated_tables(app_module.sql_db)
+        elif not database_url:
+            populated = populated_collections(app_module.mongo.db)
+        else:
+            populated = []
+        if populated:
+            print(f"Refusing to seed: {', '.join(populated)} already hold data; pass --reset to replace it",
+                  file=sys.stderr)
+            return 2
+    started = time.perf_counter()
+    if database_url:
+        with app_module.app.app_context():
+            doctor_ids, patient_ids = seed_sql(app_module.sql_db, args.doctors, args.patients, args.appointments, rng)
+            backend = app_module.sql_db.engine.dialect.name
+    else:
+        ensure_indexes(app_module.mongo.db)
+        doctor_ids, patient_ids = seed(app_module.mongo.db, args.doctors, args.patients, args.appointments, rng)
+        backend = 'mongomock' if uses_mongomock else 'mongodb'
+    print(f"Seeded {args.doctors} doctors, {args.patients} patients, {args.appointments} appointments "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    driver = HttpDriver(args.url) if args.url else TestClientDriver(app_module.app)
+    actions = build_scenarios(driver, doctor_ids, patient_ids, rng, args.sessions)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'backend': backend,
+            'driver': 'http' if args.url else 'test_client',
+            'doctors': args.doctors,
+            'patients': args.patients,
+            'appointments': args.appointments,
+            'seed': args.seed,
+        },
+        'scenarios': {}
+    }
+    for name in args.scenarios.split(','):
+        requests = args.signin_requests if name == 'signin' else args.requests
+        report['scenarios'][name] = run_scenario(actions[name], requests, args.concurrency, count_queries=not args.url)
+        print(f"{name:22s} p50 {report['scenarios'][name]['p50_ms']:9.2f} ms  "
+              f"p95 {report['scenarios'][name]['p95_ms']:9.2f} ms  "
+              f"{report['scenarios'][name]['throughput_rps']:8.1f} req/s", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(report, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import datetime
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pymongo import UpdateOne
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class CacheBackend:
+    """Storage interface for ResponseCache; implement it to move the cache to a shared store."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """The live entries among keys, by key; backends with a batch read override this."""
+        entries = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                entries[key] = value
+        return entries
+
+    def set_many(self, items):
+        for key, value in items.items():
+            self.set(key, value)
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize=1024, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete(self, key):
+        self._cache.invalidate(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class MongoBackend(CacheBackend):
+    """Entries in a MongoDB collection, shared by every worker process.
+
+    The TTL index on expires_at (indexes.py) removes expired documents; reads also
+    filter on it because the TTL monitor only runs about once a minute. Callers must
+    read outside a secondary_reads view so lookups go to the primary.
+    """
+
+    def __init__(self, collection, ttl=300):
+        self.collection = collection
+        self.ttl = ttl
+
+    def live_filter(self, keys):
+        return {'_id': {'$in': list(keys)}, 'expires_at': {'$gt': datetime.datetime.utcnow()}}
+
+    def get(self, key):
+        document = self.collection.find_one(self.live_filter([key]), {'value': 1})
+        return document['value'] if document else None
+
+    def get_many(self, keys):
+        return {document['_id']: document['value'] for document in self.collection.find(self.live_filter(keys), {'value': 1})}
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        if not items:
+            return
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl)
+        self.collection.bulk_write([
+            UpdateOne({'_id': key}, {'$set': {'value': value, 'expires_at': expires_at}}, upsert=True)
+            for key, value in items.items()
+        ], ordered=False)
+
+    def delete(self, key):
+        self.collection.delete_one({'_id': key})
+
+    def stats(self):
+        return {'backend': 'mongo', 'ttl': self.ttl}
+
+
+class ResponseCache:
+    """Caches rendered responses per namespace; invalidating a namespace retires all of its entries.
+
+    Each namespace has a generation token stored in the backend and prefixed to its keys,
+    so invalidation is a single write regardless of how many entries the namespace holds.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _generation(self, namespace):
+        generation = self.backend.get(f'gen:{namespace}')
+        if generation is None:
+            # A lost generation must never resurrect entries written under an older one
+            generation = uuid.uuid4().hex
+            self.backend.set(f'gen:{namespace}', generation)
+        return generation
+
+    def _key(self, namespace, key):
+        return f'{namespace}:{self._generation(namespace)}:{key}'
+
+    def lookup(self, namespace, key):
+        """Return (slot, entry) for key under the namespace's current generation.
+
+        Store a freshly rendered entry with set(slot, entry): the slot is resolved before
+        rendering, so a render that overlaps invalidate() lands in the retired generation
+        instead of being served as current.
+        """
+        slot = self._key(namespace, key)
+        return slot, self.backend.get(slot)
+
+    def set(self, slot, entry):
+        self.backend.set(slot, entry)
+
+    def invalidate(self, namespace):
+        self.backend.delete(f'gen:{namespace}')
@@ -0,0 +1,81 @@
+import datetime
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+# A reserved sequence number that is still unwritten after this long is treated as abandoned
+GAP_TIMEOUT = datetime.timedelta(seconds=5)
+
+
+class ChangeLog:
+    """Append-only log of appointment mutations ordered by a sequence number.
+
+    Writers reserve sequence numbers with $inc and then insert, so entries can land out
+    of order. Readers only go up to the settled sequence, the last number below which
+    nothing is still being written, so a cursor never skips a slow writer's entry.
+    """
+
+    def __init__(self, collection, counters_collection):
+        self.collection = collection
+        self.counters = counters_collection
+
+    def record(self, op, appointments):
+        """Log `op` ('insert', 'update' or 'delete') for each appointment document."""
+        if not appointments:
+            return
+        now = datetime.datetime.utcnow()
+        counter = self.counters.find_one_and_update(
+            {'_id': self.collection.name},
+            {'$inc': {'seq': len(appointments)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first = counter['seq'] - len(appointments) + 1
+        self.collection.insert_many([{
+            'seq': first + offset,
+            'op': op,
+            'appointment_id': appointment['_id'],
+            'doctor_id': appointment['doctor_id'],
+            'user_id': appointment['user_id'],
+            'ts': now
+        } for offset, appointment in enumerate(appointments)], ordered=False)
+
+    def latest(self):
+        counter = self.counters.find_one({'_id': self.collection.name})
+        return counter['seq'] if counter else 0
+
+    def oldest(self):
+        entry = self.collection.find_one({}, {'seq': 1}, sort=[('seq', ASCENDING)])
+        return entry['seq'] if entry else None
+
+    def settled(self):
+        latest = self.latest()
+        cutoff = datetime.datetime.utcnow() - GAP_TIMEOUT
+        # Everything up to the newest entry older than the timeout is settled by definition
+        old = self.collection.find_one({'ts': {'$lte': cutoff}}, {'seq': 1}, sort=[('seq', DESCENDING)])
+        floor = old['seq'] if old else 0
+        recent = {entry['seq'] for entry in self.collection.find({'seq': {'$gt': floor}}, {'_id': 0, 'seq': 1})}
+        for seq in range(floor + 1, latest + 1):
+            if seq not in recent:
+                return seq - 1
+        return latest
+
+    def read(self, owner_field, owner_id, since, limit):
+        """Return (entries, cursor, has_more) for one user's appointments after `since`."""
+        settled = self.settled()
+        entries = list(self.collection.find(
+            {owner_field: owner_id, 'seq': {'$gt': since, '$lte': settled}},
+            {'_id': 0, 'seq': 1, 'op': 1, 'appointment_id': 1}
+        ).sort('seq', ASCENDING).limit(limit + 1))
+        if len(entries) > limit:
+            entries = entries[:limit]
+            return entries, entries[-1]['seq'], True
+        # Nothing of this user's is left below settled, so the cursor can skip ahead to it
+        return entries, max(since, settled), False
+
+
+def sse_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,134 @@
+import json
+import os
+from hashing import DEFAULT_METHOD
+
+
+def env_flag(name, default=''):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+class Config:
+    """Settings read from the environment once at startup; loaded with app.config.from_object."""
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    # 'text' or 'json'; see logging_config.configure_logging
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    # Doctor and patient names embedded into new bookings are cached per worker this long;
+    # renames are re-applied to appointments once it has passed
+    PROFILE_NAME_CACHE_TTL = int(os.environ.get('PROFILE_NAME_CACHE_TTL', 60))
+    # When enabled, role checks use the role claim in the JWT and the user record
+    # is only loaded if a handler reads a field the token does not carry.
+    TRUST_TOKEN_CLAIMS = env_flag('TRUST_TOKEN_CLAIMS')
+    AVAILABILITY_CACHE_TTL = int(os.environ.get('AVAILABILITY_CACHE_TTL', 60))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 2048))
+    # Requests slower than this are logged with their sampled stacks; 0 disables the profiler
+    SLOW_REQUEST_PROFILE_MS = int(os.environ.get('SLOW_REQUEST_PROFILE_MS', 0))
+    PROFILE_SAMPLE_INTERVAL_MS = int(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+    # Werkzeug method string; stored hashes made with other parameters are upgraded at sign-in
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 4 * PASSWORD_HASH_WORKERS))
+    # /appointments/stream re-reads the change log this often and closes the connection
+    # after CHANGE_STREAM_MAX_SECONDS so EventSource reconnects through the load balancer
+    CHANGE_STREAM_POLL_SECONDS = float(os.environ.get('CHANGE_STREAM_POLL_SECONDS', 2))
+    CHANGE_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('CHANGE_STREAM_HEARTBEAT_SECONDS', 15))
+    CHANGE_STREAM_MAX_SECONDS = float(os.environ.get('CHANGE_STREAM_MAX_SECONDS', 300))
+    # Token-bucket limits as '<requests>/<second|minute|hour|day>', per client (user id when
+    # authenticated, otherwise IP) and per route. RATE_LIMITS takes a JSON object of endpoint
+    # name to limit, merged over the defaults below; an empty limit disables it for that route.
+    RATE_LIMIT_ENABLED = env_flag('RATE_LIMIT_ENABLED', 'true')
+    RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '300/minute')
+    RATE_LIMITS = dict({
+        'signin': '10/minute',
+        'signup': '5/minute',
+        'create_appointment': '30/minute',
+        'bulk_create_appointments': '10/minute',
+        'bulk_update_appointment_status': '30/minute',
+        'export_doctor_appointments': '6/minute',
+        'stream_appointment_changes': '10/minute',
+    }, **json.loads(os.environ.get('RATE_LIMITS', '{}')))
+    RATE_LIMIT_EXEMPT = ['healthz', 'readyz', 'get_metrics', 'static']
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted for client IPs
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    # Response bodies: 'auto' serializes with orjson when it is installed, 'orjson' requires it,
+    # 'json' uses the standard library. The fast path needs UTF-8 output, so JSON_AS_ASCII is off.
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+    JSON_AS_ASCII = False
+    # Bodies of at least COMPRESSION_MIN_BYTES are sent with Content-Encoding br (when the
+    # brotli package is installed) or gzip, whichever the client accepts
+    COMPRESSION_ENABLED = env_flag('COMPRESSION_ENABLED', 'true')
+    COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+    # Appointments keep their most recent notes up to this many; 0 keeps every note
+    APPOINTMENT_NOTES_CAP = int(os.environ.get('APPOINTMENT_NOTES_CAP', 200))
+
+    # 'mongo', or 'sql' to serve the core routes from the SQLAlchemy models in models.py
+    # (SQLite in WAL mode by default) for clinics without a MongoDB cluster
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL',
+        'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'clinic.db')
+    )
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+
+    # MongoDB. The client is created on first use, so none of this touches the network at import.
+    MONGO_URI = os.environ.get('MONGO_URI', 'mongodb+srv://karan:<kaRanlande45>@cluster0.icdaxwo.mongodb.net/?retryWrites=true&w=majority&appName=Cluster0')
+    MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'physioconnect')
+    # Size the pool to the worker's concurrency (threads per worker); requests beyond it
+    # wait up to MONGO_WAIT_QUEUE_TIMEOUT_MS for a connection and then fail fast.
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 32))
+    MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+    # primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    # Listing endpoints read from secondaries at most this many seconds behind the
+    # primary (MongoDB requires at least 90); a user who wrote within
+    # READ_YOUR_WRITES_SECONDS reads from the primary instead
+    MONGO_SECONDARY_READS = env_flag('MONGO_SECONDARY_READS', 'true')
+    MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', 90))
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', MONGO_MAX_STALENESS_SECONDS))
+    # Where those write markers live: 'mongo' shares them between all workers and hosts through
+    # a TTL collection read on the primary; 'memory' keeps them per process, which only holds
+    # the guarantee for a single-process deployment
+    READ_YOUR_WRITES_STORE = os.environ.get('READ_YOUR_WRITES_STORE', 'mongo')
+    # A number of nodes or 'majority'
+    MONGO_WRITE_CONCERN = os.environ.get('MONGO_WRITE_CONCERN', 'majority')
+    MONGO_WRITE_TIMEOUT_MS = int(os.environ.get('MONGO_WRITE_TIMEOUT_MS', 5000))
+    # /readyz fails if a ping takes longer than this
+    READINESS_TIMEOUT_MS = int(os.environ.get('READINESS_TIMEOUT_MS', 1000))
+    # Missing indexes are created before the first request: the unique slot index is what
+    # rejects double bookings. Turn this off only where `flask ensure-indexes` runs as a
+    # deploy step.
+    ENSURE_INDEXES_ON_STARTUP = env_flag('ENSURE_INDEXES_ON_STARTUP', 'true')
+    # A failed index build is retried after this long, doubling up to the maximum
+    SCHEMA_RETRY_SECONDS = float(os.environ.get('SCHEMA_RETRY_SECONDS', 5))
+    SCHEMA_RETRY_MAX_SECONDS = float(os.environ.get('SCHEMA_RETRY_MAX_SECONDS', 300))
+
+
+def mongo_client_options(config):
+    """Keyword arguments for MongoClient (or Motor) built from the MONGO_* settings."""
+    write_concern = config['MONGO_WRITE_CONCERN']
+    return {
+        'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+        'minPoolSize': config['MONGO_MIN_POOL_SIZE'],
+        'maxIdleTimeMS': config['MONGO_MAX_IDLE_TIME_MS'],
+        'waitQueueTimeoutMS': config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        'serverSelectionTimeoutMS': config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'connectTimeoutMS': config['MONGO_CONNECT_TIMEOUT_MS'],
+        'socketTimeoutMS': config['MONGO_SOCKET_TIMEOUT_MS'],
+        'readPreference': config['MONGO_READ_PREFERENCE'],
+        'w': int(write_concern) if write_concern.isdigit() else write_concern,
+        'wTimeoutMS': config['MONGO_WRITE_TIMEOUT_MS'],
+        'appname': 'physioconnect',
+    }
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    """Applies update_many jobs on a background thread so the request that triggered them returns at once.
+
+    Used to push changed display fields into the documents that copy them. A job that
+    still fails after `retries` attempts is logged and dropped; the backfill command
+    repairs anything it left stale. Delayed work is kept on the same thread: see schedule().
+    """
+
+    def __init__(self, retries=3, backoff=0.5):
+        self.retries = retries
+        self.backoff = backoff
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # key -> (due, fn, args); the heap holds (due, seq, key) and may keep superseded entries
+        self._scheduled = {}
+        self._timers = []
+        self._sequence = itertools.count()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fanout', daemon=True)
+                self._thread.start()
+
+    def submit(self, description, collection, query, update):
+        self._start()
+        self._queue.put((description, collection, query, update))
+
+    def schedule(self, delay, key, fn, *args):
+        """Call fn(*args) on the worker thread once `delay` seconds have passed.
+
+        Scheduling a key that is already waiting pushes it back instead of adding a second call.
+        """
+        self._start()
+        due = time.monotonic() + delay
+        sequence = next(self._sequence)
+        with self._lock:
+            self._scheduled[key] = (due, fn, args)
+            heapq.heappush(self._timers, (due, sequence, key))
+            earliest = self._timers[0][1] == sequence
+        if earliest:
+            # Wakes the worker so it waits for the new, nearer deadline
+            self._queue.put(None)
+
+    def join(self):
+        """Block until every submitted job has been applied or given up on."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            self._run_due()
+            try:
+                job = self._queue.get(timeout=self._next_wait())
+            except queue.Empty:
+                continue
+            try:
+                if job is not None:
+                    self._apply(*job)
+            finally:
+                self._queue.task_done()
+
+    def _next_wait(self):
+        with self._lock:
+            if not self._timers:
+                return None
+            return max(0, self._timers[0][0] - time.monotonic())
+
+    def _run_due(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > now:
+                    return
+                due, _, key = heapq.heappop(self._timers)
+                entry = self._scheduled.get(key)
+                if entry is None or entry[0] != due:
+                    # Pushed back by a later schedule() of the same key
+                    continue
+                del self._scheduled[key]
+            _, fn, args = entry
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error("Scheduled fan-out %s failed: %s", key, e)
+
+    def _apply(self, description, collection, query, update):
+        for attempt in range(self.retries):
+            try:
+                result = collection.update_many(query, update)
+                logger.info("Fan-out %s updated %s documents", description, result.modified_count)
+                return
+            except Exception as e:
+                logger.warning("Fan-out %s failed (attempt %s of %s): %s", description, attempt + 1, self.retries, e)
+                time.sleep(self.backoff * 2 ** attempt)
+        with self._lock:
+            self.failed += 1
+        logger.error("Fan-out %s abandoned; run flask backfill-appointment-identities --all", description)
+
+    def stats(self):
+        return {'pending': self._queue.unfinished_tasks, 'scheduled': len(self._scheduled), 'failed': self.failed}
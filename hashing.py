@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:260000'
+
+logger = logging.getLogger(__name__)
+
+
+class HasherSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class HasherUnavailable(Exception):
+    """Raised when the pool broke again after being replaced."""
+
+
+def normalize_method(method):
+    """Spell out the defaults Werkzeug applies so equivalent methods compare equal."""
+    if method == 'pbkdf2':
+        method = 'pbkdf2:sha256'
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method = f'{method}:260000'
+    return method
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """Runs password hashing on a dedicated process pool so it never holds a request thread's GIL.
+
+    At most `workers + queue_size` operations may be in flight; beyond that callers get
+    HasherSaturated immediately instead of queueing behind a login burst.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=None, queue_size=None, timeout=30, salt_length=16):
+        self.method = normalize_method(method)
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + (self.workers * 4 if queue_size is None else queue_size)
+        self.timeout = timeout
+        self.salt_length = salt_length
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        # Created on first use, in the serving worker. Its children are never forked from it:
+        # by then it runs driver, logging and request threads whose locks a fork would copy
+        # mid-use. A forkserver (or spawn where that is unavailable) starts them from a
+        # clean process that only imports this module.
+        with self._lock:
+            if self._executor is None:
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _discard(self, executor):
+        # Only the broken pool is dropped; a concurrent caller may already have replaced it
+        with self._lock:
+            if self._executor is executor:
+                executor.shutdown(wait=False)
+                self._executor = None
+
+    def _submit(self, fn, args):
+        """Submit on a slot the caller has acquired; the slot is released when the task is done."""
+        with self._lock:
+            self.in_flight += 1
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._discard(executor)
+            raise
+        except BaseException:
+            self._release()
+            raise
+        # The slot stays taken until the pool has finished the task, even if the caller
+        # gives up waiting, so a backlog of timed-out hashes still counts as saturation
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherSaturated()
+        try:
+            return self._submit(fn, args)
+        except BrokenProcessPool:
+            # A crashed or OOM-killed worker breaks the whole pool; retry once on a fresh one,
+            # waiting for the slot the failed attempt hands back
+            logger.warning("Password hashing pool broke; replacing it")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherSaturated()
+        try:
+            return self._submit(fn, args)
+        except BrokenProcessPool:
+            raise HasherUnavailable()
+
+    def _release(self, future=None):
+        finished = (future is not None and not future.cancelled()
+                    and not isinstance(future.exception(), BrokenProcessPool))
+        with self._lock:
+            self.in_flight -= 1
+            if finished:
+                self.completed += 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(_verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was produced with parameters other than the configured method."""
+        return normalize_method(pwhash.split('$', 1)[0]) != self.method
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,131 @@
+import logging
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Every index the hot query paths rely on, keyed by collection name
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True),
+    ],
+    'doctor_profiles': [
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('specialty', ASCENDING), ('experience', ASCENDING)]),
+        # Specialty listings and searches paged by user_id
+        IndexModel([('specialty', ASCENDING), ('user_id', ASCENDING)]),
+        # Backs /doctors/search; a collection can only have one text index
+        IndexModel([('name', TEXT), ('specialty', TEXT), ('bio', TEXT)], name='doctor_search',
+                   weights={'name': 10, 'specialty': 5, 'bio': 1}),
+    ],
+    'patient_profiles': [
+        IndexModel([('user_id', ASCENDING)]),
+    ],
+    'appointments': [
+        # Also serves doctor_id lookups and per-doctor date ranges via its prefix
+        IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING), ('time', ASCENDING)],
+                   name='doctor_slot_unique', unique=True),
+        IndexModel([('user_id', ASCENDING), ('date', ASCENDING)]),
+        # Keyset-paginated listings: each owner's appointments in _id order, without a SORT stage
+        IndexModel([('doctor_id', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('user_id', ASCENDING), ('_id', ASCENDING)]),
+    ],
+    'appointment_changes': [
+        IndexModel([('seq', ASCENDING)], unique=True),
+        IndexModel([('doctor_id', ASCENDING), ('seq', ASCENDING)]),
+        IndexModel([('user_id', ASCENDING), ('seq', ASCENDING)]),
+        # Clients further behind than this get 410 and must reload their listing
+        IndexModel([('ts', ASCENDING)], expireAfterSeconds=CHANGE_LOG_RETENTION_SECONDS),
+    ],
+    # Read-your-writes markers (cache.MongoBackend); looked up by _id
+    'write_markers': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Without these, sign-ups and bookings admit duplicates; every other index only costs speed
+REQUIRED_INDEXES = {('users', 'email_1'), ('appointments', 'doctor_slot_unique')}
+
+# Representative filters for the queries issued by the routes, checked with explain;
+# a third element is the sort the route applies, which must come from the index too
+_sample_id = ObjectId()
+QUERY_SHAPES = [
+    ('users', {'email': 'user@example.com'}),
+    ('users', {'_id': _sample_id, 'role': 'doctor'}),
+    ('doctor_profiles', {'user_id': _sample_id}),
+    ('doctor_profiles', {'user_id': {'$gt': _sample_id}}),
+    ('doctor_profiles', {'specialty': 'sports', 'experience': {'$gte': 5}}),
+    ('doctor_profiles', {'specialty': 'sports', 'user_id': {'$gt': _sample_id}}),
+    ('doctor_profiles', {'$text': {'$search': 'sports injury'}}),
+    ('patient_profiles', {'user_id': _sample_id}),
+    ('appointments', {'doctor_id': _sample_id}),
+    ('appointments', {'doctor_id': _sample_id, 'date': {'$gte': '2024-01-01', '$lte': '2024-01-31'}}),
+    ('appointments', {'doctor_id': _sample_id, 'date': '2024-01-01', 'time': '09:00'}),
+    ('appointments', {'user_id': _sample_id}),
+    ('appointments', {'user_id': {'$in': [_sample_id]}}),
+    ('appointments', {'doctor_id': _sample_id, '_id': {'$gt': _sample_id}}, {'_id': 1}),
+    ('appointments', {'user_id': _sample_id, '_id': {'$gt': _sample_id}}, {'_id': 1}),
+    ('appointments', {'doctor_id': _sample_id}, {'date': 1, 'time': 1}),
+    ('appointment_changes', {'doctor_id': _sample_id, 'seq': {'$gt': 0, '$lte': 10}}),
+    ('appointment_changes', {'user_id': _sample_id, 'seq': {'$gt': 0, '$lte': 10}}),
+    ('appointment_changes', {'seq': {'$gt': 0}}),
+    ('write_markers', {'_id': {'$in': ['doctors', str(_sample_id)]}}),
+]
+
+
+class IndexCreationError(Exception):
+    """Required indexes could not be built, e.g. existing duplicates block a unique index."""
+
+
+def ensure_indexes(db):
+    """Create any declared index that is missing; existing indexes are left untouched.
+
+    Indexes are built one at a time so one failure does not hold back the rest. Returns
+    the optional indexes that failed as 'collection.name: error' strings; if any of
+    REQUIRED_INDEXES failed, raises IndexCreationError after every index was attempted.
+    """
+    required_failures = []
+    optional_failures = []
+    for collection_name, models in INDEXES.items():
+        created = []
+        for model in models:
+            name = model.document['name']
+            try:
+                created.extend(db[collection_name].create_indexes([model]))
+            except Exception as e:
+                logger.error("Error creating index %s on %s: %s", name, collection_name, e)
+                failures = required_failures if (collection_name, name) in REQUIRED_INDEXES else optional_failures
+                failures.append(f'{collection_name}.{name}: {e}')
+        logger.info("Indexes ensured on %s: %s", collection_name, ', '.join(created))
+    if required_failures:
+        raise IndexCreationError('; '.join(required_failures))
+    return optional_failures
+
+
+def _plan_stages(plan):
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from _plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def find_unindexed(db, shapes=QUERY_SHAPES):
+    """Return (collection, filter, stage) for shapes whose winning plan scans the collection or sorts in memory."""
+    unindexed = []
+    for collection_name, query, *sort in shapes:
+        command = {'find': collection_name, 'filter': query}
+        if sort:
+            command['sort'] = sort[0]
+        explain = db.command('explain', command, verbosity='queryPlanner')
+        winning_plan = explain['queryPlanner']['winningPlan']
+        # Servers using the slot-based engine nest the classic plan under queryPlan
+        winning_plan = winning_plan.get('queryPlan', winning_plan)
+        stages = set(_plan_stages(winning_plan))
+        for stage in ('COLLSCAN', 'SORT'):
+            if stage in stages:
+                unindexed.append((collection_name, query, stage))
+                break
+    return unindexed
@@ -0,0 +1,255 @@
+import collections
+import os
+import sys
+import threading
+import time
+from pymongo import monitoring
+
+# Per-thread stats for the request currently being handled; None outside requests
+_local = threading.local()
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_time', 'slowest_command', 'slowest_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_command = None
+        self.slowest_time = 0.0
+
+
+def begin_request():
+    _local.stats = RequestStats()
+    return _local.stats
+
+
+def end_request():
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Attributes each MongoDB command to the request running on the issuing thread."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return
+        seconds = event.duration_micros / 1e6
+        stats.queries += 1
+        stats.db_time += seconds
+        if seconds > stats.slowest_time:
+            stats.slowest_time = seconds
+            stats.slowest_command = event.command_name
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks connection pool usage per server for the health endpoints and /metrics."""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, address):
+        pool = self._pools.get(address)
+        if pool is None:
+            pool = self._pools[address] = {'max_size': None, 'open': 0, 'in_use': 0, 'waiting': 0, 'checkout_failures': 0}
+        return pool
+
+    def _update(self, address, **deltas):
+        with self._lock:
+            pool = self._pool(address)
+            for key, delta in deltas.items():
+                pool[key] += delta
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)['max_size'] = event.options.get('maxPoolSize')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        self._update(event.address, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event.address, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event.address, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._update(event.address, waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._update(event.address, waiting=-1, in_use=1)
+
+    def connection_checked_in(self, event):
+        self._update(event.address, in_use=-1)
+
+    def stats(self):
+        """Per-server pool counters, with utilization as the share of max_size in use."""
+        with self._lock:
+            pools = {f'{host}:{port}': dict(pool) for (host, port), pool in self._pools.items()}
+        for pool in pools.values():
+            pool['utilization'] = round(pool['in_use'] / pool['max_size'], 3) if pool['max_size'] else None
+        return pools
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class Histogram:
+    def __init__(self, name, description, buckets, label_names):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (bucket_counts, total, count) in sorted(self._series.items()):
+                labels = list(zip(self.label_names, label_values))
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f'{self.name}_bucket{{{_format_labels(labels + [("le", bound)])}}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{_format_labels(labels + [("le", "+Inf")])}}} {count}')
+                lines.append(f'{self.name}_sum{{{_format_labels(labels)}}} {total}')
+                lines.append(f'{self.name}_count{{{_format_labels(labels)}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = collections.Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{_format_labels(zip(self.label_names, label_values))}}} {value}')
+        return lines
+
+
+class Metrics:
+    """Per-route request metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.requests = Counter(
+            'physioconnect_http_requests_total', 'HTTP requests handled.', ('method', 'route', 'status'))
+        self.request_duration = Histogram(
+            'physioconnect_http_request_duration_seconds', 'Request latency.',
+            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5), ('method', 'route'))
+        self.db_queries = Histogram(
+            'physioconnect_db_queries_per_request', 'MongoDB commands issued per request.',
+            (0, 1, 2, 3, 5, 10, 20, 50, 100), ('method', 'route'))
+        self.db_duration = Histogram(
+            'physioconnect_db_duration_seconds', 'Time spent in MongoDB per request.',
+            (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1), ('method', 'route'))
+
+    def observe(self, method, route, status, duration, stats):
+        self.requests.inc(method, route, status)
+        self.request_duration.observe(duration, method, route)
+        self.db_queries.observe(stats.queries, method, route)
+        self.db_duration.observe(stats.db_time, method, route)
+
+    def render(self, extra_lines=()):
+        lines = []
+        for metric in (self.requests, self.request_duration, self.db_queries, self.db_duration):
+            lines.extend(metric.render())
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered request threads from a background thread.
+
+    Only threads between start() and stop() are sampled, so the cost is one
+    sys._current_frames() call per interval while requests are in flight.
+    """
+
+    def __init__(self, interval=0.005, max_depth=30):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self._collapse(frame)] += 1
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
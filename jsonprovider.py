@@ -0,0 +1,96 @@
+import datetime
+import json
+from bson import ObjectId
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_default(obj):
+    """Encode the types the JSON modules lack: ObjectIds as hex strings, datetimes as UTC ISO 8601."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime.datetime):
+        # Naive datetimes are UTC throughout the app (utcnow)
+        if obj.tzinfo is None:
+            return obj.isoformat(timespec='seconds') + 'Z'
+        return obj.isoformat(timespec='seconds').replace('+00:00', 'Z')
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JSONProvider:
+    """Serializes response bodies as compact JSON; JSON_PROVIDER selects the implementation."""
+
+    name = None
+
+    def dumps(self, obj, sort_keys=False):
+        raise NotImplementedError
+
+
+class StdlibJSONProvider(JSONProvider):
+    name = 'json'
+
+    def dumps(self, obj, sort_keys=False):
+        return json.dumps(obj, default=encode_default, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False)
+
+
+class OrjsonJSONProvider(JSONProvider):
+    """orjson, several times faster than the standard library on long lists; dates render as in encode_default."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        self.options = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_OMIT_MICROSECONDS
+        self._fallback = StdlibJSONProvider()
+
+    def dumps(self, obj, sort_keys=False):
+        options = self.options | orjson.OPT_SORT_KEYS if sort_keys else self.options
+        try:
+            return orjson.dumps(obj, default=encode_default, option=options).decode()
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits, for one, are left to the standard library
+            return self._fallback.dumps(obj, sort_keys=sort_keys)
+
+
+def make_json_provider(name='auto'):
+    """'auto' uses orjson when it is installed and the standard library otherwise."""
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('JSON_PROVIDER is orjson but orjson is not installed')
+        return OrjsonJSONProvider()
+    if name == 'json':
+        return StdlibJSONProvider()
+    raise ValueError(f'Unknown JSON_PROVIDER {name!r}; use auto, orjson or json')
+
+
+class ProviderJSONEncoder(FlaskJSONEncoder):
+    """app.json_encoder that hands compact output to a JSONProvider.
+
+    Flask 2.0 has no provider hook, but jsonify builds its encoder from
+    app.json_encoder, so this is where the fast path plugs in. Indented output
+    (debug, JSONIFY_PRETTYPRINT_REGULAR) and JSON_AS_ASCII keep Flask's encoder.
+    """
+
+    provider = StdlibJSONProvider()
+
+    def default(self, o):
+        try:
+            return encode_default(o)
+        except TypeError:
+            return super().default(o)
+
+    def encode(self, o):
+        if self.indent is None and not self.ensure_ascii:
+            return self.provider.dumps(o, sort_keys=self.sort_keys)
+        return super().encode(o)
+
+
+def json_encoder_for(provider):
+    return type('JSONEncoder', (ProviderJSONEncoder,), {'provider': provider})
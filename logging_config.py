@@ -0,0 +1,118 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Id of the request being handled, attached to every record logged while it runs
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', '-') != '-':
+            entry['request_id'] = record.request_id
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(request_id)s]: %(message)s')
+
+
+def configure_logging(level='INFO', fmt='text', stream=None):
+    """Route all logging through a queue drained by a background listener thread.
+
+    Request threads only build the record and enqueue it; the formatting of the
+    final line and the write to `stream` happen on the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _flush_on_exit():
+    if _listener is not None:
+        _listener.stop()
+
+
+class RateLimitedLogger:
+    """Logger wrapper for messages emitted once per row: each call site logs at most
+    `per_interval` records per `interval` seconds and reports how many it suppressed."""
+
+    def __init__(self, logger, per_interval=10, interval=1.0):
+        self.logger = logger
+        self.per_interval = per_interval
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.interval:
+                window_start, count = now, 0
+                reported, suppressed = suppressed, 0
+            else:
+                reported = 0
+            if count < self.per_interval:
+                self._windows[key] = (window_start, count + 1, suppressed)
+                return True, reported
+            self._windows[key] = (window_start, count, suppressed + 1)
+            return False, 0
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, suppressed = self._allow(msg)
+        if not allowed:
+            return
+        if suppressed:
+            msg = f'{msg} (%d similar messages suppressed)'
+            args = args + (suppressed,)
+        self.logger.log(level, msg, *args, stacklevel=3)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
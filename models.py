@@ -1,33 +1,91 @@
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
 from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
+# Relationships are declared lazy='raise': every query in sqlstorage.py states what it
+# loads (selectinload/joinedload), so a missing option fails loudly instead of
+# quietly issuing one query per row.
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(50), nullable=False, default='user')  # 'user' or 'doctor'
-    appointments = db.relationship('Appointment', backref='user', lazy=True, foreign_keys='Appointment.user_id')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    doctor = db.relationship('Doctor', back_populates='user', uselist=False, lazy='raise')
+    patient_profile = db.relationship('PatientProfile', back_populates='user', uselist=False, lazy='raise')
+    appointments = db.relationship('Appointment', back_populates='user', lazy='raise', foreign_keys='Appointment.user_id')
 
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    profile = db.relationship('Profile', backref='doctor', uselist=False)
-    appointments = db.relationship('Appointment', backref='doctor', lazy=True, foreign_keys='Appointment.doctor_id')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    user = db.relationship('User', back_populates='doctor', lazy='raise')
+    profile = db.relationship('Profile', back_populates='doctor', uselist=False, lazy='raise')
+    appointments = db.relationship('Appointment', back_populates='doctor', lazy='raise', foreign_keys='Appointment.doctor_id')
 
 class Profile(db.Model):
+    __table_args__ = (
+        db.Index('ix_profile_specialty_experience', 'specialty', 'experience'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False, unique=True)
     name = db.Column(db.String(100), nullable=False)
     specialty = db.Column(db.String(100), nullable=False)
     bio = db.Column(db.Text)
+    experience = db.Column(db.Integer, nullable=False, default=0)
+    working_hours = db.Column(db.JSON)
+    slot_minutes = db.Column(db.Integer)
     is_visible = db.Column(db.Boolean, default=False)  # Controls visibility to users
+    doctor = db.relationship('Doctor', back_populates='profile', lazy='raise')
+
+class PatientProfile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    name = db.Column(db.String(100), nullable=False)
+    age = db.Column(db.Integer)
+    medical_history = db.Column(db.Text)
+    user = db.relationship('User', back_populates='patient_profile', lazy='raise')
 
 class Appointment(db.Model):
+    __table_args__ = (
+        # A booked slot; its doctor_id prefix also serves per-doctor listings and date ranges
+        db.UniqueConstraint('doctor_id', 'date', 'time', name='doctor_slot_unique'),
+        db.Index('ix_appointment_user_date', 'user_id', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
-    date = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(50), nullable=False, default='pending')  # 'pending', 'accepted', 'declined'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    date = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD, as in the MongoDB documents
+    time = db.Column(db.String(5), nullable=False)  # HH:MM
+    reason = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(50), nullable=False, default='pending')  # see VALID_STATUSES in app.py
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', back_populates='appointments', lazy='raise', foreign_keys=[user_id])
+    doctor = db.relationship('Doctor', back_populates='appointments', lazy='raise', foreign_keys=[doctor_id])
+    notes = db.relationship('AppointmentNote', back_populates='appointment', lazy='raise',
+                            order_by='AppointmentNote.id', cascade='all, delete-orphan')
+
+class AppointmentNote(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, index=True)
+    text = db.Column(db.Text, nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    author_role = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    appointment = db.relationship('Appointment', back_populates='notes', lazy='raise')
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """WAL lets readers proceed while a booking commits; SQLite leaves foreign keys off unless asked."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
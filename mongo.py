@@ -0,0 +1,86 @@
+import contextvars
+import threading
+import time
+from pymongo import MongoClient
+
+# Read preference for the request being handled; None reads from the primary.
+# Only the read methods below follow it, so writes always go to the primary.
+read_preference_var = contextvars.ContextVar('read_preference', default=None)
+READ_METHODS = frozenset({'find', 'find_one', 'aggregate', 'count_documents', 'distinct'})
+
+
+class LazyCollection:
+    """Stands in for a collection until the first operation creates the client."""
+
+    def __init__(self, mongo, name):
+        self._mongo = mongo
+        self._collection = None
+        self._views = {}
+        self.name = name
+
+    def __getattr__(self, attr):
+        if self._collection is None:
+            self._collection = self._mongo.db[self.name]
+        if attr in READ_METHODS:
+            read_preference = read_preference_var.get()
+            if read_preference is not None:
+                return getattr(self._view(read_preference), attr)
+        return getattr(self._collection, attr)
+
+    def _view(self, read_preference):
+        key = (read_preference.name, read_preference.max_staleness)
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = self._collection.with_options(read_preference=read_preference)
+        return view
+
+    def __repr__(self):
+        return f'LazyCollection({self.name!r})'
+
+
+class Mongo:
+    """Creates the client on first use instead of at import.
+
+    Constructing a client for a mongodb+srv URI resolves DNS and starts monitor
+    threads; deferring it keeps worker boot fast, lets app.py be imported offline,
+    and means forking servers create the client in the child that uses it.
+    """
+
+    def __init__(self, uri, db_name, client_class=MongoClient, **client_options):
+        self.uri = uri
+        self.db_name = db_name
+        self.client_class = client_class
+        self.client_options = client_options
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.client_class(self.uri, **self.client_options)
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    @property
+    def connected(self):
+        return self._client is not None
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def ping(self):
+        """Round-trip a ping to the server; returns the latency in seconds."""
+        started = time.perf_counter()
+        self.client.admin.command('ping')
+        return time.perf_counter() - started
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
@@ -0,0 +1,97 @@
+import collections
+import math
+import threading
+import time
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Limit:
+    """A token bucket holding `capacity` requests that refills completely every `period` seconds."""
+
+    __slots__ = ('capacity', 'period', 'rate')
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse '<requests>/<second|minute|hour|day>', e.g. '10/minute'."""
+        try:
+            count, period = spec.split('/')
+            return cls(int(count), PERIODS[period.strip()])
+        except (ValueError, KeyError):
+            raise ValueError(f'Invalid rate limit {spec!r}; expected <requests>/<{"|".join(PERIODS)}>')
+
+
+class BucketStore:
+    """Storage interface for RateLimiter; implement it to share buckets between workers."""
+
+    def consume(self, key, capacity, rate, cost=1):
+        """Take `cost` tokens from key's bucket; returns (allowed, tokens left)."""
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    """Per-process buckets, refilled lazily on access; the least recently used are evicted beyond maxsize."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                # An evicted bucket comes back full, which is what it would have refilled to anyway
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class RateLimitResult:
+    __slots__ = ('allowed', 'limit', 'remaining', 'retry_after', 'reset')
+
+    def __init__(self, allowed, limit, tokens):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = int(tokens)
+        self.retry_after = 0 if allowed else math.ceil((1 - tokens) / limit.rate)
+        self.reset = math.ceil((limit.capacity - tokens) / limit.rate)
+
+    def headers(self):
+        # Fields from the IETF RateLimit header draft, plus Retry-After when rejected
+        headers = {
+            'RateLimit-Limit': str(self.limit.capacity),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset),
+            'RateLimit-Policy': f'{self.limit.capacity};w={self.limit.period}',
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    """Token-bucket limits per route, each client getting its own bucket per route."""
+
+    def __init__(self, store, default, limits=None):
+        self.store = store
+        self.default = Limit.parse(default) if default else None
+        self.limits = {route: Limit.parse(spec) if spec else None for route, spec in (limits or {}).items()}
+
+    def hit(self, route, client):
+        """Charge one request by client to route; returns None when the route is unlimited."""
+        limit = self.limits.get(route, self.default)
+        if limit is None:
+            return None
+        allowed, tokens = self.store.consume(f'{route}:{client}', limit.capacity, limit.rate)
+        return RateLimitResult(allowed, limit, tokens)
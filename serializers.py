@@ -0,0 +1,96 @@
+from availability import DEFAULT_SLOT_MINUTES, DEFAULT_WORKING_HOURS
+
+
+class Field:
+    """Where an output key comes from: document[source], or default when it is absent.
+
+    With fallback the default also replaces falsy values; convert is applied to
+    anything else that is not None.
+    """
+
+    __slots__ = ('source', 'default', 'convert', 'fallback')
+
+    def __init__(self, source, default=None, convert=None, fallback=False):
+        self.source = source
+        self.default = default
+        self.convert = convert
+        self.fallback = fallback
+
+
+class Serializer:
+    """Renders documents from either storage backend as response dicts.
+
+    Keyword arguments name the output keys. `projection` covers every source field,
+    so a query can fetch exactly what is rendered. Values the JSON provider encodes
+    natively (datetimes, nested ObjectIds) are passed through untouched; ids are
+    converted with str so they stay strings for SQL's integer ids too.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self._plan = tuple((name, field.source, field.default, field.convert, field.fallback)
+                           for name, field in fields.items())
+
+    def __call__(self, document, **extra):
+        result = {}
+        for name, source, default, convert, fallback in self._plan:
+            value = document.get(source, default)
+            if fallback and not value:
+                value = default
+            elif convert is not None and value is not None:
+                value = convert(value)
+            result[name] = value
+        if extra:
+            result.update(extra)
+        return result
+
+    def extend(self, **fields):
+        return Serializer(**dict(self.fields, **fields))
+
+    @property
+    def projection(self):
+        return {field.source: 1 for field in self.fields.values()}
+
+
+DOCTOR_FIELDS = {
+    'name': Field('name'),
+    'specialty': Field('specialty', ''),
+    'bio': Field('bio', ''),
+    'experience': Field('experience', 0),
+}
+SCHEDULE_FIELDS = {
+    'working_hours': Field('working_hours', DEFAULT_WORKING_HOURS),
+    'slot_minutes': Field('slot_minutes', DEFAULT_SLOT_MINUTES),
+}
+
+# Doctors as patients see them, identified by their user id
+doctor_summary = Serializer(id=Field('user_id', convert=str), email=Field('email'), **DOCTOR_FIELDS)
+doctor_detail = doctor_summary.extend(**SCHEDULE_FIELDS)
+
+# Profiles as their owner sees them, identified by the profile id
+doctor_profile = Serializer(id=Field('_id', convert=str), **DOCTOR_FIELDS)
+doctor_profile_detail = doctor_profile.extend(user_id=Field('user_id', convert=str), **SCHEDULE_FIELDS)
+patient_profile = Serializer(
+    id=Field('_id', convert=str),
+    name=Field('name'),
+    age=Field('age'),
+    medical_history=Field('medical_history', ''),
+)
+
+note = Serializer(
+    id=Field('id', convert=str),
+    text=Field('text'),
+    author_role=Field('author_role'),
+    created_at=Field('created_at'),
+)
+
+appointment = Serializer(
+    id=Field('_id', convert=str),
+    date=Field('date', 'Unknown', fallback=True),
+    time=Field('time', 'Unknown', fallback=True),
+    reason=Field('reason', 'Not specified', fallback=True),
+    status=Field('status', 'pending', fallback=True),
+)
+# Each side of an appointment sees the other party's id
+doctor_appointment = appointment.extend(user_id=Field('user_id', convert=str))
+patient_appointment = appointment.extend(doctor_id=Field('doctor_id', convert=str))
@@ -0,0 +1,348 @@
+import time
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, contains_eager, joinedload
+from models import Appointment, AppointmentNote, Doctor, PatientProfile, Profile, User
+from storage import SlotTaken, Storage
+
+
+def user_record(user, password=False):
+    record = {'_id': user.id, 'email': user.email, 'role': user.role, 'created_at': user.created_at}
+    if password:
+        record['password'] = user.password
+    return record
+
+
+def doctor_profile_record(profile):
+    record = {
+        '_id': profile.id,
+        'user_id': profile.doctor.user_id,
+        'name': profile.name,
+        'specialty': profile.specialty,
+        'bio': profile.bio,
+        'experience': profile.experience,
+    }
+    # Left out when unset so callers fall back to the defaults, as with older documents
+    if profile.working_hours is not None:
+        record['working_hours'] = profile.working_hours
+    if profile.slot_minutes is not None:
+        record['slot_minutes'] = profile.slot_minutes
+    return record
+
+
+def patient_profile_record(profile):
+    return {
+        '_id': profile.id,
+        'user_id': profile.user_id,
+        'name': profile.name,
+        'age': profile.age,
+        'medical_history': profile.medical_history,
+    }
+
+
+def note_record(note):
+    return {
+        'id': note.id,
+        'text': note.text,
+        'author_id': note.author_id,
+        'author_role': note.author_role,
+        'created_at': note.created_at,
+    }
+
+
+def appointment_record(appointment, latest_note=None, notes_count=0):
+    """An appointment with the identity and note fields MongoDB embeds, read from the eager-loaded rows."""
+    doctor = appointment.doctor
+    patient = appointment.user
+    return {
+        '_id': appointment.id,
+        'doctor_id': doctor.user_id,
+        'user_id': appointment.user_id,
+        'date': appointment.date,
+        'time': appointment.time,
+        'reason': appointment.reason,
+        'status': appointment.status,
+        'doctor_name': doctor.profile.name if doctor.profile else None,
+        'doctor_email': doctor.user.email,
+        'patient_name': patient.patient_profile.name if patient.patient_profile else None,
+        'patient_email': patient.email,
+        'latest_note': note_record(latest_note) if latest_note is not None else None,
+        'notes_count': notes_count,
+    }
+
+
+class SQLStorage(Storage):
+    """Storage on the SQLAlchemy models, for deployments without a MongoDB cluster.
+
+    Appointments are joined to their doctor and patient at read time instead of
+    copying names into each row: many-to-one relationships are joined into the
+    listing query, and so are each row's note count and latest note, so a page costs
+    one query and never loads a note history.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def session(self):
+        return self.db.session
+
+    def parse_id(self, value):
+        return int(value)
+
+    def ensure_schema(self):
+        self.db.create_all()
+        return []
+
+    def ping(self):
+        started = time.perf_counter()
+        self.session.execute(text('SELECT 1'))
+        return time.perf_counter() - started
+
+    def _insert(self, row):
+        """Add and commit row; returns its id, read before the commit expires it."""
+        self.session.add(row)
+        self.session.flush()
+        row_id = row.id
+        self.session.commit()
+        return row_id
+
+    def get_user(self, user_id):
+        user = self.session.get(User, user_id)
+        return user_record(user) if user else None
+
+    def find_user_by_email(self, email):
+        user = self.session.execute(select(User).where(User.email == email)).scalar_one_or_none()
+        return user_record(user, password=True) if user else None
+
+    def create_user(self, user):
+        row = User(email=user['email'], password=user['password'], role=user['role'], created_at=user['created_at'])
+        if row.role == 'doctor':
+            row.doctor = Doctor()
+        return self._insert(row)
+
+    def replace_password(self, user, password):
+        self.session.execute(
+            update(User).where(User.id == user['_id'], User.password == user['password']).values(password=password)
+        )
+        self.session.commit()
+
+    def _doctor(self, user_id):
+        """The doctor row for a doctor user, created for accounts that predate it."""
+        doctor = self.session.execute(select(Doctor).where(Doctor.user_id == user_id)).scalar_one_or_none()
+        if doctor is None:
+            doctor = Doctor(user_id=user_id)
+            self.session.add(doctor)
+            self.session.flush()
+        return doctor
+
+    def _doctor_profiles(self):
+        return select(Profile).join(Profile.doctor).options(contains_eager(Profile.doctor))
+
+    def list_doctors(self, after, limit, specialty=None, min_experience=None):
+        query = (
+            select(Profile)
+            .join(Profile.doctor)
+            .join(Doctor.user)
+            .options(contains_eager(Profile.doctor).contains_eager(Doctor.user))
+            .order_by(Doctor.user_id)
+            .limit(limit + 1)
+        )
+        if after:
+            query = query.where(Doctor.user_id > after)
+        if specialty:
+            query = query.where(Profile.specialty == specialty)
+        if min_experience is not None:
+            query = query.where(Profile.experience >= min_experience)
+        rows = []
+        for profile in self.session.execute(query).scalars():
+            row = doctor_profile_record(profile)
+            row.update(email=profile.doctor.user.email, role=profile.doctor.user.role)
+            rows.append(row)
+        return rows
+
+    def find_doctor_profile(self, user_id, projection=None):
+        profile = self.session.execute(self._doctor_profiles().where(Doctor.user_id == user_id)).scalar_one_or_none()
+        return doctor_profile_record(profile) if profile else None
+
+    def get_doctor_profile(self, profile_id, projection=None):
+        profile = self.session.execute(self._doctor_profiles().where(Profile.id == profile_id)).scalar_one_or_none()
+        return doctor_profile_record(profile) if profile else None
+
+    def create_doctor_profile(self, profile):
+        row = Profile(
+            doctor_id=self._doctor(profile['user_id']).id,
+            name=profile['name'],
+            specialty=profile['specialty'],
+            bio=profile['bio'],
+            experience=profile['experience'],
+            working_hours=profile['working_hours'],
+            slot_minutes=profile['slot_minutes'],
+        )
+        return self._insert(row)
+
+    def update_doctor_profile(self, profile_id, fields):
+        self.session.execute(update(Profile).where(Profile.id == profile_id).values(**fields))
+        self.session.commit()
+
+    def find_patient_profile(self, user_id, projection=None):
+        profile = self.session.execute(
+            select(PatientProfile).where(PatientProfile.user_id == user_id)
+        ).scalar_one_or_none()
+        return patient_profile_record(profile) if profile else None
+
+    def create_patient_profile(self, profile):
+        row = PatientProfile(
+            user_id=profile['user_id'],
+            name=profile['name'],
+            age=profile['age'],
+            medical_history=profile['medical_history'],
+        )
+        return self._insert(row)
+
+    def list_appointments(self, key, owner_id, after, limit, date_filter=None):
+        # Correlated per row and served by the appointment_id index, so the cost follows
+        # the page size rather than the length of any appointment's history
+        notes_count = (
+            select(func.count(AppointmentNote.id))
+            .where(AppointmentNote.appointment_id == Appointment.id)
+            .scalar_subquery()
+        )
+        latest_note_id = (
+            select(func.max(AppointmentNote.id))
+            .where(AppointmentNote.appointment_id == Appointment.id)
+            .scalar_subquery()
+        )
+        latest_note = aliased(AppointmentNote)
+        query = (
+            select(Appointment, latest_note, notes_count)
+            .join(Appointment.doctor)
+            .outerjoin(latest_note, latest_note.id == latest_note_id)
+            .options(
+                contains_eager(Appointment.doctor).joinedload(Doctor.user),
+                contains_eager(Appointment.doctor).joinedload(Doctor.profile),
+                joinedload(Appointment.user).joinedload(User.patient_profile),
+            )
+            .order_by(Appointment.id)
+            .limit(limit + 1)
+        )
+        if key == 'doctor_id':
+            query = query.where(Doctor.user_id == owner_id)
+        else:
+            query = query.where(Appointment.user_id == owner_id)
+        if after:
+            query = query.where(Appointment.id > after)
+        date_filter = date_filter or {}
+        if '$gte' in date_filter:
+            query = query.where(Appointment.date >= date_filter['$gte'])
+        if '$lte' in date_filter:
+            query = query.where(Appointment.date <= date_filter['$lte'])
+        return [
+            appointment_record(appointment, note, count)
+            for appointment, note, count in self.session.execute(query)
+        ]
+
+    def resolve_identities(self, appointments, key):
+        # Every record from list_appointments already carries the names and emails
+        return {}, {}
+
+    def booked_slots(self, doctor_id, first, last):
+        rows = self.session.execute(
+            select(Appointment.date, Appointment.time)
+            .join(Appointment.doctor)
+            .where(Doctor.user_id == doctor_id, Appointment.date >= first, Appointment.date <= last)
+        )
+        return [{'date': date, 'time': time_of_day} for date, time_of_day in rows]
+
+    def create_appointment(self, appointment):
+        row = Appointment(
+            doctor_id=self._doctor(appointment['doctor_id']).id,
+            user_id=appointment['user_id'],
+            date=appointment['date'],
+            time=appointment['time'],
+            reason=appointment['reason'],
+            status=appointment['status'],
+            created_at=appointment['created_at'],
+        )
+        notes = [self._note(note) for note in appointment['note_entries']]
+        row.notes = notes
+        self.session.add(row)
+        try:
+            self.session.flush()
+        except IntegrityError:
+            # The doctor and patient were checked before the insert, so this is doctor_slot_unique
+            self.session.rollback()
+            raise SlotTaken()
+        appointment_id = row.id
+        # The response is rendered from the submitted document; give its notes their row ids
+        for note, note_row in zip(appointment['note_entries'], notes):
+            note['id'] = note_row.id
+        self.session.commit()
+        return appointment_id
+
+    def _note(self, note):
+        return AppointmentNote(
+            text=note['text'],
+            author_id=note['author_id'],
+            author_role=note['author_role'],
+            created_at=note['created_at'],
+        )
+
+    def get_appointment(self, appointment_id):
+        appointment = self.session.execute(
+            select(Appointment)
+            .join(Appointment.doctor)
+            .options(contains_eager(Appointment.doctor))
+            .where(Appointment.id == appointment_id)
+        ).scalar_one_or_none()
+        if appointment is None:
+            return None
+        return {
+            '_id': appointment.id,
+            'doctor_id': appointment.doctor.user_id,
+            'user_id': appointment.user_id,
+            'date': appointment.date,
+            'time': appointment.time,
+            'status': appointment.status,
+        }
+
+    def list_appointment_notes(self, appointment_id, offset, limit):
+        notes_count = (
+            select(func.count(AppointmentNote.id))
+            .where(AppointmentNote.appointment_id == Appointment.id)
+            .scalar_subquery()
+        )
+        row = self.session.execute(
+            select(Appointment, notes_count)
+            .join(Appointment.doctor)
+            .options(contains_eager(Appointment.doctor))
+            .where(Appointment.id == appointment_id)
+        ).one_or_none()
+        if row is None:
+            return None, [], 0
+        appointment, count = row
+        notes = self.session.execute(
+            select(AppointmentNote)
+            .where(AppointmentNote.appointment_id == appointment_id)
+            .order_by(AppointmentNote.id)
+            .offset(offset)
+            .limit(limit + 1)
+        ).scalars()
+        return {
+            '_id': appointment.id,
+            'doctor_id': appointment.doctor.user_id,
+            'user_id': appointment.user_id,
+        }, [note_record(note) for note in notes], count
+
+    def update_appointment_status(self, appointment_id, status, note=None):
+        self.session.execute(update(Appointment).where(Appointment.id == appointment_id).values(status=status))
+        if note:
+            note_row = self._note(note)
+            note_row.appointment_id = appointment_id
+            self.session.add(note_row)
+        self.session.commit()
+
+    def delete_appointment(self, appointment_id):
+        self.session.execute(delete(AppointmentNote).where(AppointmentNote.appointment_id == appointment_id))
+        self.session.execute(delete(Appointment).where(Appointment.id == appointment_id))
+        self.session.commit()
@@ -0,0 +1,109 @@
+class SlotTaken(Exception):
+    """The doctor already has an appointment at that date and time."""
+
+
+class Storage:
+    """Data access for the routes served by every backend; selected by STORAGE_BACKEND.
+
+    MongoStorage (app.py) runs the queries the routes always ran; SQLStorage
+    (sqlstorage.py) serves the same shapes from the models in models.py. Records are
+    dicts keyed like the MongoDB documents, with '_id' holding the backend's id type,
+    so formatting and validation in app.py do not depend on the backend.
+    """
+
+    # Routes that need MongoDB itself (aggregations, change log, exports) answer 501 otherwise
+    supports_mongo_features = False
+
+    def parse_id(self, value):
+        """Convert an id from a URL, token or payload; raises on malformed input."""
+        raise NotImplementedError
+
+    def ensure_schema(self):
+        """Create missing indexes (MongoDB) or tables and indexes (SQL).
+
+        Returns descriptions of optional indexes that could not be built; raises if
+        anything the data's integrity depends on is missing.
+        """
+        raise NotImplementedError
+
+    def ping(self):
+        """Round-trip to the database; returns the latency in seconds."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """The user without its password hash, or None."""
+        raise NotImplementedError
+
+    def find_user_by_email(self, email):
+        raise NotImplementedError
+
+    def create_user(self, user):
+        """Insert a user document; returns its id."""
+        raise NotImplementedError
+
+    def replace_password(self, user, password):
+        """Store a new hash unless the password changed since `user` was read."""
+        raise NotImplementedError
+
+    def list_doctors(self, after, limit, specialty=None, min_experience=None):
+        """Up to limit + 1 profiles ordered by user_id, each with its user's email and role."""
+        raise NotImplementedError
+
+    def find_doctor_profile(self, user_id, projection=None):
+        """The doctor's profile, or None.
+
+        projection (a serializer's) limits the fields MongoDB returns; SQL records are
+        built from the whole row either way.
+        """
+        raise NotImplementedError
+
+    def get_doctor_profile(self, profile_id, projection=None):
+        raise NotImplementedError
+
+    def create_doctor_profile(self, profile):
+        raise NotImplementedError
+
+    def update_doctor_profile(self, profile_id, fields):
+        raise NotImplementedError
+
+    def find_patient_profile(self, user_id, projection=None):
+        raise NotImplementedError
+
+    def create_patient_profile(self, profile):
+        raise NotImplementedError
+
+    def list_appointments(self, key, owner_id, after, limit, date_filter=None):
+        """Up to limit + 1 appointments whose `key` ('doctor_id' or 'user_id') is owner_id, by id.
+
+        date_filter holds optional '$gte' and '$lte' dates as built by parse_date_range.
+        """
+        raise NotImplementedError
+
+    def resolve_identities(self, appointments, key):
+        """(users, profiles) by id for the appointment[key] records the rows do not embed."""
+        raise NotImplementedError
+
+    def booked_slots(self, doctor_id, first, last):
+        """The date and time of each of a doctor's appointments between two dates."""
+        raise NotImplementedError
+
+    def create_appointment(self, appointment):
+        """Insert an appointment built by build_appointment; raises SlotTaken if the slot is booked."""
+        raise NotImplementedError
+
+    def get_appointment(self, appointment_id):
+        raise NotImplementedError
+
+    def list_appointment_notes(self, appointment_id, offset, limit):
+        """(appointment, up to limit + 1 notes oldest first from offset, total note count).
+
+        The appointment carries doctor_id and user_id for the access check; it is None,
+        with no notes, if there is no such appointment.
+        """
+        raise NotImplementedError
+
+    def update_appointment_status(self, appointment_id, status, note=None):
+        raise NotImplementedError
+
+    def delete_appointment(self, appointment_id):
+        raise NotImplementedError